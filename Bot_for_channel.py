@@ -1,24 +1,581 @@
+import time
+STARTUP_STARTED = time.perf_counter()
+
 import os
 import re
+import hmac
+import json
+import queue
+import random
+import signal
+import heapq
 import asyncio
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
 from threading import Thread
-from flask import Flask
+from pathlib import Path
 from datetime import datetime
-import pytz
-from telegram import Update, MessageEntity
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
+from telegram import ChatPermissions, Update, MessageEntity
+from telegram.error import RetryAfter
+from telegram.helpers import escape, mention_html
+from telegram.request import BaseRequest, HTTPXRequest
+from telegram.ext import (
+    Application,
+    ApplicationHandlerStop,
+    BaseUpdateProcessor,
+    ChatMemberHandler,
+    CommandHandler,
+    MessageHandler,
+    ContextTypes,
+    filters,
+)
+
+# ===== STARTUP TIMING =====
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "3000"))
+
+class StartupTimer:
+    """Breaks the cold start down into phases, up to the first handled update.
+
+    ``mark(phase)`` records the time since the previous mark; each phase is kept
+    only once. The breakdown is printed when the first update is done.
+    """
+
+    def __init__(self, started: float, budget_ms: float):
+        self.budget_ms = budget_ms
+        self.phases = {}  # {phase: ms}, in order
+        self._last = started
+
+    @property
+    def total_ms(self) -> float:
+        return sum(self.phases.values())
+
+    def mark(self, phase: str):
+        if phase in self.phases:
+            return
+        now = time.perf_counter()
+        self.phases[phase] = (now - self._last) * 1000
+        self._last = now
+        if phase == "first_update":
+            self.report()
+
+    def report(self):
+        total = self.total_ms
+        status = "over budget" if total > self.budget_ms else "ok"
+        print(
+            f"Startup {total:.0f} ms to first update ({status}, budget {self.budget_ms:.0f} ms): "
+            + ", ".join(f"{phase} {ms:.0f}" for phase, ms in self.phases.items())
+        )
+
+startup = StartupTimer(STARTUP_STARTED, STARTUP_BUDGET_MS)
+startup.mark("imports")
 
 # ===== WEBKEEP ALIVE =====
-app_web = Flask(__name__)
 OWNER_ID = int(os.getenv("OWNER_ID", "0"))
-
-@app_web.route("/")
-def home():
-    return "Bot is online!"
+PORT = int(os.environ.get("PORT", 10000))
+HEALTH_SERVER = os.getenv("HEALTH_SERVER", "1") == "1"
+# /metrics answers only "Authorization: Bearer <METRICS_TOKEN>"; unset disables it.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 
 def keep_alive():
-    port = int(os.environ.get("PORT", 10000))
-    Thread(target=lambda: app_web.run(host="0.0.0.0", port=port)).start()
+    # Flask is only needed for the polling-mode health check, so it is imported
+    # here rather than on every cold start.
+    from flask import Flask, Response, request
+
+    app_web = Flask(__name__)
+
+    @app_web.route("/")
+    def home():
+        return "Bot is online!"
+
+    @app_web.route("/metrics")
+    def metrics_endpoint():
+        status = metrics_auth_status(request.headers.get("Authorization", ""))
+        if status != 200:
+            return Response("", status=status)
+        return Response(metrics.render_threadsafe(), mimetype="text/plain; version=0.0.4")
+
+    port = PORT
+    Thread(target=lambda: app_web.run(host="0.0.0.0", port=port), daemon=True).start()
+
+# ===== METRICS =====
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_MAX_CHATS = int(os.getenv("METRICS_MAX_CHATS", "200"))
+
+def metrics_auth_status(authorization: str) -> int:
+    if not METRICS_TOKEN:
+        return 404
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        return 401
+    return 200
+
+class Metrics:
+    """Counters and latency histograms kept in plain dicts, rendered as Prometheus text.
+
+    Series are keyed by a tuple of ``(label, value)`` pairs. ``collect()`` adds
+    series computed at scrape time from the other components' own stats.
+    Those stats belong to the event loop, so other threads scrape through
+    ``render_threadsafe()``.
+    """
+
+    def __init__(self):
+        self._meta = {}        # {name: (type, help)}
+        self._counters = {}    # {name: {labels: value}}
+        self._histograms = {}  # {name: {labels: [per-bucket..., +Inf, sum, count]}}
+        self._collectors = {}  # {name: () -> {labels: value}}
+        self._chats = set()
+        self.loop = None  # set in post_init
+
+    def counter(self, name: str, help_text: str):
+        self._meta[name] = ("counter", help_text)
+        self._counters[name] = {}
+
+    def histogram(self, name: str, help_text: str):
+        self._meta[name] = ("histogram", help_text)
+        self._histograms[name] = {}
+
+    def collect(self, name: str, kind: str, help_text: str, fn):
+        self._meta[name] = (kind, help_text)
+        self._collectors[name] = fn
+
+    def chat_label(self, chat_id) -> str:
+        # Cap label cardinality: chats past the limit share one series
+        if chat_id is None:
+            return ""
+        if chat_id > 0:
+            return "private"  # user ids stay out of the labels
+        if chat_id in self._chats or len(self._chats) < METRICS_MAX_CHATS:
+            self._chats.add(chat_id)
+            return str(chat_id)
+        return "other"
+
+    def inc(self, name: str, labels: tuple, value: float = 1):
+        series = self._counters[name]
+        series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name: str, labels: tuple, seconds: float):
+        series = self._histograms[name]
+        h = series.get(labels)
+        if h is None:
+            h = series[labels] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0]
+        h[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+    @staticmethod
+    def _labels(labels, extra: str = "") -> str:
+        parts = []
+        for k, v in labels:
+            v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            parts.append(f'{k}="{v}"')
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text) in list(self._meta.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if name in self._histograms:
+                for labels, h in list(self._histograms[name].items()):
+                    cumulative = 0
+                    for le, n in zip(LATENCY_BUCKETS + ("+Inf",), h):
+                        cumulative += n
+                        bucket = self._labels(labels, f'le="{le}"')
+                        lines.append(f"{name}_bucket{bucket} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {h[-2]}")
+                    lines.append(f"{name}_count{self._labels(labels)} {h[-1]}")
+                continue
+            series = self._counters.get(name)
+            if series is None:
+                try:
+                    series = self._collectors[name]()
+                except Exception as e:
+                    print("metrics collect error:", name, e)
+                    series = {}
+            for labels, value in list(series.items()):
+                lines.append(f"{name}{self._labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def render_threadsafe(self, timeout: float = 5.0) -> str:
+        loop = self.loop
+        if loop is None or not loop.is_running():
+            return self.render()
+
+        async def render():
+            return self.render()
+
+        return asyncio.run_coroutine_threadsafe(render(), loop).result(timeout)
+
+metrics = Metrics()
+metrics.histogram("bot_handler_seconds", "Handler latency in seconds.")
+metrics.counter("bot_handler_calls_total", "Handler invocations by handler and chat.")
+metrics.counter("bot_handler_errors_total", "Handler exceptions by handler and chat.")
+metrics.histogram("bot_api_seconds", "Bot API call latency in seconds.")
+metrics.counter("bot_api_calls_total", "Bot API calls by method and chat.")
+metrics.counter("bot_api_errors_total", "Failed Bot API calls by method and chat.")
+metrics.counter("bot_api_rate_limited_total", "Bot API calls answered with 429 by method and chat.")
+
+# ===== OUTBOUND SEND SCHEDULER =====
+# Priority classes, most important first. Under pressure the lowest class is shed first.
+PRIORITY_MODERATION = 0   # deletes, report DMs
+PRIORITY_GAME = 1         # game results, command replies
+PRIORITY_CHATTER = 2      # responders, greetings, temporary warnings
+PRIORITY_NAMES = ("moderation", "game", "chatter")
+
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))         # msgs/s, all chats
+OUTBOX_GROUP_PER_MINUTE = float(os.getenv("OUTBOX_GROUP_PER_MINUTE", "20"))
+OUTBOX_PRIVATE_RATE = float(os.getenv("OUTBOX_PRIVATE_RATE", "1"))       # msgs/s per user
+OUTBOX_MAX_PENDING = int(os.getenv("OUTBOX_MAX_PENDING", "5000"))
+OUTBOX_MAX_IN_FLIGHT = int(os.getenv("OUTBOX_MAX_IN_FLIGHT", "30"))
+OUTBOX_CHATTER_MAX_WAIT = float(os.getenv("OUTBOX_CHATTER_MAX_WAIT", "30"))
+OUTBOX_MAX_RETRIES = 5
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class OutboundJob:
+    __slots__ = ("priority", "chat_id", "call", "future", "queued_at", "retries")
+
+    def __init__(self, priority, chat_id, call, future):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.retries = 0
+
+
+class Outbox:
+    """Sends every outbound Bot API call through global and per-chat token buckets.
+
+    Jobs are zero-argument coroutine functions queued per priority class and per
+    chat (round-robin between chats). A RetryAfter pauses the affected chat and
+    puts the job back at the head of its queue. When the queue is full, or a
+    chatter job has waited too long, the lowest-priority work is dropped.
+    ``chat_id=None`` marks calls that only count against the global limit.
+    """
+
+    def __init__(self):
+        self._queues = [OrderedDict() for _ in PRIORITY_NAMES]  # [{chat_id: deque[job]}]
+        self._pending = 0
+        self._global = TokenBucket(OUTBOX_GLOBAL_RATE, OUTBOX_GLOBAL_RATE)
+        self._buckets = {}       # {chat_id: TokenBucket}
+        self._paused = {}        # {chat_id: monotonic time}, None = everything
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(OUTBOX_MAX_IN_FLIGHT)
+        self._running = set()
+        self._task = None
+        self._next_sweep = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = [0] * len(PRIORITY_NAMES)
+        self._waits = [[0, 0.0, 0.0] for _ in PRIORITY_NAMES]  # [count, total, max]
+
+    # ----- submitting -----
+    def post(self, priority: int, chat_id, call):
+        """Queue a call and forget about it; failures are logged."""
+        self._enqueue(OutboundJob(priority, chat_id, call, None))
+
+    async def send(self, priority: int, chat_id, call):
+        """Queue a call and wait for its result (None if it was dropped)."""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(OutboundJob(priority, chat_id, call, future))
+        return await future
+
+    def _enqueue(self, job: OutboundJob, front: bool = False):
+        if self._pending >= OUTBOX_MAX_PENDING and not self._shed(job.priority):
+            self._drop(job)
+            return
+        chat_queue = self._queues[job.priority].setdefault(job.chat_id, deque())
+        if front:
+            chat_queue.appendleft(job)
+        else:
+            chat_queue.append(job)
+        self._pending += 1
+        self._wakeup.set()
+
+    def _shed(self, priority: int) -> bool:
+        # Make room by dropping the oldest job of a strictly lower class.
+        for p in range(len(self._queues) - 1, priority, -1):
+            queues = self._queues[p]
+            if queues:
+                chat_id, chat_queue = next(iter(queues.items()))
+                self._drop(chat_queue.popleft())
+                if not chat_queue:
+                    del queues[chat_id]
+                self._pending -= 1
+                return True
+        return False
+
+    def _drop(self, job: OutboundJob):
+        self.dropped[job.priority] += 1
+        if job.future and not job.future.done():
+            job.future.set_result(None)
+
+    # ----- dispatching -----
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                rate, burst = OUTBOX_GROUP_PER_MINUTE / 60, OUTBOX_GROUP_PER_MINUTE
+            else:
+                rate, burst = OUTBOX_PRIVATE_RATE, max(1.0, OUTBOX_PRIVATE_RATE)
+            bucket = self._buckets[chat_id] = TokenBucket(rate, burst)
+        return bucket
+
+    def _chat_delay(self, chat_id, now: float) -> float:
+        delay = self._paused.get(chat_id, 0.0) - now
+        if chat_id is not None:
+            delay = max(delay, self._bucket(chat_id).delay(now))
+        return max(delay, 0.0)
+
+    def _next_job(self, now: float):
+        """Return (job, None) for the next sendable job, or (None, seconds to wait)."""
+        wait = max(self._global.delay(now), self._paused.get(None, 0.0) - now)
+        if wait > 0:
+            return None, wait
+        wait = None
+        for queues in self._queues:
+            for chat_id, chat_queue in queues.items():
+                delay = self._chat_delay(chat_id, now)
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                job = chat_queue.popleft()
+                if chat_queue:
+                    queues.move_to_end(chat_id)
+                else:
+                    del queues[chat_id]
+                self._pending -= 1
+                return job, None
+        return None, wait
+
+    def _sweep(self, now: float):
+        self._next_sweep = now + 60
+        for chat_id in [c for c, b in self._buckets.items() if b.full(now)]:
+            del self._buckets[chat_id]
+        for chat_id in [c for c, t in self._paused.items() if t <= now]:
+            del self._paused[chat_id]
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            if now >= self._next_sweep:
+                self._sweep(now)
+            job, wait = self._next_job(now)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            waited = now - job.queued_at
+            if job.priority == PRIORITY_CHATTER and waited > OUTBOX_CHATTER_MAX_WAIT:
+                self._drop(job)
+                continue
+            if job.retries == 0:
+                stat = self._waits[job.priority]
+                stat[0] += 1
+                stat[1] += waited
+                stat[2] = max(stat[2], waited)
+
+            self._global.take()
+            if job.chat_id is not None:
+                self._bucket(job.chat_id).take()
+            await self._slots.acquire()
+            task = asyncio.create_task(self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, job: OutboundJob):
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            self.retried += 1
+            job.retries += 1
+            if job.retries <= OUTBOX_MAX_RETRIES:
+                self._paused[job.chat_id] = time.monotonic() + e.retry_after
+                self._enqueue(job, front=True)
+            else:
+                self._fail(job, e)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self.sent += 1
+            if job.future and not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def _fail(self, job: OutboundJob, error: Exception):
+        self.failed += 1
+        if job.future:
+            if not job.future.done():
+                job.future.set_exception(error)
+        else:
+            print("outbox error:", error)
+
+    # ----- lifecycle / metrics -----
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0):
+        deadline = time.monotonic() + timeout
+        # Calls already in flight are waited for too: the HTTP client is closed
+        # right after this returns. A RetryAfter can put one back in the queue.
+        while (self._pending or self._running) and time.monotonic() < deadline:
+            if self._pending:
+                await asyncio.sleep(0.05)
+            else:
+                await asyncio.wait(set(self._running), timeout=deadline - time.monotonic())
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "depth": {
+                name: sum(len(q) for q in self._queues[p].values())
+                for p, name in enumerate(PRIORITY_NAMES)
+            },
+            "sent": self.sent,
+            "failed": self.failed,
+            "retry_after": self.retried,
+            "dropped": dict(zip(PRIORITY_NAMES, self.dropped)),
+            "wait_avg_ms": {
+                name: (total / count * 1000 if count else 0.0)
+                for name, (count, total, _) in zip(PRIORITY_NAMES, self._waits)
+            },
+            "wait_max_ms": {
+                name: peak * 1000 for name, (_, _, peak) in zip(PRIORITY_NAMES, self._waits)
+            },
+        }
+
+outbox = Outbox()
+
+def reply(msg, text: str, priority: int = PRIORITY_GAME, **kwargs):
+    outbox.post(priority, msg.chat_id, lambda: msg.reply_text(text, **kwargs))
+
+# ===== CHAT MEMBER CACHE =====
+MEMBER_CACHE_TTL = int(os.getenv("MEMBER_CACHE_TTL", "300"))
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", "50000"))
+ADMIN_STATUSES = ("administrator", "creator")
+
+class MemberStatusCache:
+    """LRU cache of chat member statuses keyed by (chat_id, user_id), with a TTL."""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # {(chat_id, user_id): (status, expires_at)}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id: int, user_id: int):
+        key = (chat_id, user_id)
+        entry = self._data.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, chat_id: int, user_id: int, status: str):
+        key = (chat_id, user_id)
+        self._data[key] = (status, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, chat_id: int, user_id: int):
+        self._data.pop((chat_id, user_id), None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+member_cache = MemberStatusCache(MEMBER_CACHE_TTL, MEMBER_CACHE_SIZE)
+
+async def get_member_status(bot, chat_id: int, user_id: int) -> str:
+    status = member_cache.get(chat_id, user_id)
+    if status is None:
+        member = await bot.get_chat_member(chat_id, user_id)
+        status = member.status
+        member_cache.set(chat_id, user_id, status)
+    return status
+
+# ===== ADMIN ROSTER CACHE =====
+ADMIN_ROSTER_TTL = int(os.getenv("ADMIN_ROSTER_TTL", "600"))
+
+class AdminRoster:
+    """Cached human admin ids per chat, dropped whenever an admin status changes."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._rosters = {}  # {chat_id: (admin_ids, expires_at)}
+
+    async def get(self, bot, chat_id: int) -> list:
+        entry = self._rosters.get(chat_id)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        admins = await bot.get_chat_administrators(chat_id)
+        for admin in admins:
+            member_cache.set(chat_id, admin.user.id, admin.status)
+        admin_ids = [a.user.id for a in admins if not a.user.is_bot]
+        self._rosters[chat_id] = (admin_ids, time.monotonic() + self.ttl)
+        return admin_ids
+
+    def invalidate(self, chat_id: int):
+        self._rosters.pop(chat_id, None)
+
+admin_roster = AdminRoster(ADMIN_ROSTER_TTL)
+
+async def track_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Telegram pushes every status change, so the caches never have to wait for their TTL.
+    change = update.chat_member or update.my_chat_member
+    if not change:
+        return
+    old, new = change.old_chat_member, change.new_chat_member
+    member_cache.set(change.chat.id, new.user.id, new.status)
+    if old.status != new.status and (old.status in ADMIN_STATUSES or new.status in ADMIN_STATUSES):
+        admin_roster.invalidate(change.chat.id)
 
 # ===== MODERATION HELPERS =====
 def msg_is_forwarded(msg) -> bool:
@@ -30,33 +587,443 @@ def msg_is_forwarded(msg) -> bool:
         or getattr(msg, "forward_sender_name", None)
     )
 
-def msg_has_link(msg) -> bool:
-    text = (msg.text or msg.caption or "")[:4096]
-    t = text.lower()
+# ===== NEAR-DUPLICATE SPAM =====
+SPAM_DUP_THRESHOLD = int(os.getenv("SPAM_DUP_THRESHOLD", "3"))      # distinct senders
+SPAM_DUP_WINDOW = float(os.getenv("SPAM_DUP_WINDOW", "900"))
+SPAM_DUP_SIMILARITY = float(os.getenv("SPAM_DUP_SIMILARITY", "0.6"))
+SPAM_DUP_MIN_CHARS = int(os.getenv("SPAM_DUP_MIN_CHARS", "40"))
+SPAM_DUP_MAX_CLUSTERS = int(os.getenv("SPAM_DUP_MAX_CLUSTERS", "20000"))
+
+NON_WORD_RE = re.compile(r"[\W_]+")
+DIGITS_RE = re.compile(r"\d+")
+
+class SpamFingerprints:
+    """Cross-chat index of recent near-identical messages.
+
+    Text is normalized (case, punctuation, digit runs) and cut into word
+    3-shingles. The ``k`` smallest shingle hashes form a bottom-k MinHash
+    sketch. A message joins the recent cluster whose sketch it overlaps by at
+    least ``similarity``. Once a cluster has ``threshold`` distinct senders,
+    that message and every later one in the cluster are reported as spam.
+    Clusters live for ``window`` seconds from their first message, and at most
+    ``max_clusters`` are kept.
+    """
+
+    K = 16
+
+    def __init__(self, threshold, window, similarity, min_chars, max_clusters):
+        self.threshold = threshold
+        self.window = window
+        self.similarity = similarity
+        self.min_chars = min_chars
+        self.max_clusters = max_clusters
+        self._clusters = OrderedDict()  # {id: [sketch, expires_at, senders]}, oldest first
+        self._index = {}                # {min-hash: cluster id}
+        self._next_id = 0
+        self.flagged = 0
+
+    def __len__(self):
+        return len(self._clusters)
+
+    def sketch(self, text: str):
+        words = DIGITS_RE.sub("0", NON_WORD_RE.sub(" ", text.lower())).split()
+        if sum(map(len, words)) < self.min_chars:
+            return None
+        hashes = {hash(s) for s in zip(words, words[1:], words[2:])}
+        return sorted(hashes)[:self.K]
+
+    def check(self, text: str, user_id: int, now: float) -> bool:
+        sketch = self.sketch(text)
+        if not sketch:
+            return False
+        self._expire(now)
+
+        votes = {}
+        for h in sketch:
+            cid = self._index.get(h)
+            if cid is not None:
+                votes[cid] = votes.get(cid, 0) + 1
+        cluster = None
+        if votes:
+            cid, overlap = max(votes.items(), key=lambda kv: kv[1])
+            cluster = self._clusters[cid]
+            if overlap < self.similarity * max(len(sketch), len(cluster[0])):
+                cluster = None
+
+        if cluster is None:
+            self._add(sketch, user_id, now)
+            return False
+
+        senders = cluster[2]
+        if len(senders) < self.threshold:
+            senders.add(user_id)
+        if len(senders) >= self.threshold:
+            self.flagged += 1
+            return True
+        return False
+
+    def _add(self, sketch, user_id: int, now: float):
+        cid = self._next_id
+        self._next_id += 1
+        self._clusters[cid] = [sketch, now + self.window, {user_id}]
+        for h in sketch:
+            self._index[h] = cid
+        while len(self._clusters) > self.max_clusters:
+            self._remove(next(iter(self._clusters)))
+
+    def _expire(self, now: float):
+        while self._clusters:
+            cid, cluster = next(iter(self._clusters.items()))
+            if cluster[1] > now:
+                break
+            self._remove(cid)
+
+    def _remove(self, cid: int):
+        sketch = self._clusters.pop(cid)[0]
+        for h in sketch:
+            if self._index.get(h) == cid:
+                del self._index[h]
+
+spam_fingerprints = SpamFingerprints(
+    SPAM_DUP_THRESHOLD, SPAM_DUP_WINDOW, SPAM_DUP_SIMILARITY,
+    SPAM_DUP_MIN_CHARS, SPAM_DUP_MAX_CLUSTERS,
+)
 
-    # common link patterns
-    if re.search(r"(https?://|www\.|t\.me/|telegram\.me/)", t):
-        return True
+# ===== LINK / AD DETECTION =====
+LINK_TLDS = os.getenv("LINK_TLDS", "com,net,org,io,co,me,gg,app,xyz,site,dev,ph")
+ALLOWED_DOMAINS = os.getenv("ALLOWED_DOMAINS", "")
 
-    # plain domains without http(s), ex: google.com
-    if re.search(r"\b[a-z0-9-]+\.(com|net|org|io|co|me|gg|app|xyz|site|dev|ph)\b", t):
-        return True
+RULE_WARNINGS = {
+    "forwarded": "⚠️ Forwarded messages are not allowed.",
+    "near_duplicate": "🚫 Spam is not allowed.",
+}
+DEFAULT_RULE_WARNING = "🚫 Ads / links are not allowed."
 
-    # telegram entities (clickable links)
-    entities = (msg.entities or []) + (msg.caption_entities or [])
-    for e in entities:
-        if e.type in (MessageEntityType.URL, MessageEntityType.TEXT_LINK):
+def link_domain(url: str) -> str:
+    host = url.split("://", 1)[-1].split("/", 1)[0].split("?", 1)[0]
+    host = host.rsplit("@", 1)[-1].split(":", 1)[0].lower()
+    return host[4:] if host.startswith("www.") else host
+
+def domain_allowed(domain: str, allowed) -> bool:
+    if domain in allowed:
+        return True
+    return any(domain.endswith("." + a) for a in allowed)
+
+class ModerationPipeline:
+    """Moderation rules run cheapest first; the first rule that fires wins.
+
+    Each rule is a ``(name, check)`` pair where ``check(msg, text)`` returns a bool.
+    Per-rule call counts, hit counts and total time are kept for tuning.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.stats = {name: [0, 0, 0] for name, _ in rules}  # {name: [calls, hits, ns]}
+
+    def check(self, msg):
+        text = msg.text or msg.caption or ""
+        for name, rule in self.rules:
+            started = time.perf_counter_ns()
+            hit = rule(msg, text)
+            stat = self.stats[name]
+            stat[0] += 1
+            stat[2] += time.perf_counter_ns() - started
+            if hit:
+                stat[1] += 1
+                return name
+        return None
+
+def build_moderation_pipeline(
+    tlds: str = LINK_TLDS,
+    allowed_domains: str = ALLOWED_DOMAINS,
+    fingerprints: SpamFingerprints = spam_fingerprints,
+):
+    allowed = frozenset(d.strip().lower() for d in allowed_domains.split(",") if d.strip())
+    tld_alt = "|".join(re.escape(t.strip().lower()) for t in tlds.split(",") if t.strip())
+
+    invite_re = re.compile(r"\b((?:t|telegram)\.(?:me|dog))/\S", re.IGNORECASE)
+    url_re = re.compile(r"(?:https?://|\bwww\.)([^\s/?#]+)", re.IGNORECASE)
+    domain_re = re.compile(rf"\b((?:[a-z0-9-]+\.)+(?:{tld_alt}))\b", re.IGNORECASE)
+
+    def blocked(domain: str) -> bool:
+        return not domain_allowed(domain, allowed)
+
+    def rule_forwarded(msg, text):
+        return msg_is_forwarded(msg)
+
+    def rule_entity_link(msg, text):
+        for entities, parse in (
+            (msg.entities, msg.parse_entity),
+            (msg.caption_entities, msg.parse_caption_entity),
+        ):
+            for e in entities or ():
+                if e.type == MessageEntity.TEXT_LINK:
+                    url = e.url
+                elif e.type == MessageEntity.URL:
+                    url = parse(e)
+                else:
+                    continue
+                if blocked(link_domain(url)):
+                    return True
+        return False
+
+    def rule_near_duplicate(msg, text):
+        return fingerprints.check(text, msg.from_user.id, time.monotonic())
+
+    def regex_rule(pattern):
+        def rule(msg, text):
+            return any(blocked(link_domain(m.group(1))) for m in pattern.finditer(text))
+        return rule
+
+    return ModerationPipeline([
+        ("forwarded", rule_forwarded),
+        ("entity_link", rule_entity_link),
+        ("telegram_invite", regex_rule(invite_re)),
+        ("url", regex_rule(url_re)),
+        ("bare_domain", regex_rule(domain_re)),
+        ("near_duplicate", rule_near_duplicate),
+    ])
+
+moderation_pipeline = build_moderation_pipeline()
+
+# ===== DELAYED DELETION =====
+class DeletionScheduler:
+    """Deletes temporary bot messages from one background task.
+
+    Handlers register a message with ``schedule()`` and return immediately. Due
+    messages are grouped per chat and removed with ``delete_messages`` in
+    batches of up to 100 ids.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self):
+        self._heap = []  # [(delete_at, chat_id, message_id)]
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._bot = None
+        self.deleted = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, chat_id: int, message_id: int, delay: float):
+        delete_at = time.monotonic() + delay
+        heapq.heappush(self._heap, (delete_at, chat_id, message_id))
+        if self._heap[0][0] == delete_at:
+            self._wakeup.set()
+
+    def start(self, bot):
+        self._bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Don't leave temporary messages behind when the bot goes down.
+        await self._flush(float("inf"))
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._flush(time.monotonic())
+
+    async def _flush(self, now: float):
+        due = {}
+        while self._heap and self._heap[0][0] <= now:
+            _, chat_id, message_id = heapq.heappop(self._heap)
+            due.setdefault(chat_id, []).append(message_id)
+        if due:
+            await asyncio.gather(*(
+                self._delete_chat(chat_id, ids) for chat_id, ids in due.items()
+            ))
+
+    async def _delete_chat(self, chat_id: int, message_ids):
+        bot = self._bot
+        batch_delete = hasattr(bot, "delete_messages")
+        for i in range(0, len(message_ids), self.BATCH_SIZE):
+            chunk = message_ids[i:i + self.BATCH_SIZE]
+            try:
+                if batch_delete and len(chunk) > 1:
+                    ok = await outbox.send(
+                        PRIORITY_MODERATION, None, lambda: bot.delete_messages(chat_id, chunk)
+                    )
+                else:
+                    ok = all([
+                        await outbox.send(
+                            PRIORITY_MODERATION, None,
+                            lambda m=message_id: bot.delete_message(chat_id, m)
+                        )
+                        for message_id in chunk
+                    ])
+            except Exception as e:
+                ok = False
+                print("delete error:", e)
+            if ok:
+                self.deleted += len(chunk)
+            else:
+                self.failed += len(chunk)
+
+deletion_scheduler = DeletionScheduler()
+
+def send_temp_warning(chat, text: str, seconds: int = 5, priority: int = PRIORITY_CHATTER):
+    async def send():
+        warn = await chat.send_message(text)
+        deletion_scheduler.schedule(warn.chat_id, warn.message_id, seconds)
+        return warn
+    outbox.post(priority, chat.id, send)
+
+def reply_temp(msg, text: str, seconds: int = 3, priority: int = PRIORITY_GAME):
+    async def send():
+        sent = await msg.reply_text(text)
+        deletion_scheduler.schedule(sent.chat_id, sent.message_id, seconds)
+        return sent
+    outbox.post(priority, msg.chat_id, send)
+
+
+# ===== FLOOD CONTROL =====
+FLOOD_MAX_MESSAGES = int(os.getenv("FLOOD_MAX_MESSAGES", "5"))
+FLOOD_WINDOW_SECONDS = float(os.getenv("FLOOD_WINDOW_SECONDS", "5"))
+FLOOD_ACTION = os.getenv("FLOOD_ACTION", "mute")    # delete | mute | restrict
+FLOOD_PENALTY_SECONDS = int(os.getenv("FLOOD_PENALTY_SECONDS", "300"))
+FLOOD_MAX_TRACKED = int(os.getenv("FLOOD_MAX_TRACKED", "100000"))
+
+class FloodTracker:
+    """Sliding-window message counters for (chat_id, user_id) pairs.
+
+    Each tracked pair owns a slot of ``limit`` timestamps in one preallocated
+    array, used as a ring buffer. A message is a flood when the timestamp it
+    overwrites (the ``limit``-th most recent message) is still inside the
+    window, so each decision is O(1). When all ``max_tracked`` slots are in use
+    the least recently active pair is evicted, which caps memory at
+    ``max_tracked * limit`` doubles.
+    """
+
+    def __init__(self, limit: int, window: float, max_tracked: int):
+        self.limit = limit
+        self.window = window
+        self.max_tracked = max_tracked
+        self._empty = array("d", [float("-inf")]) * limit
+        self._times = self._empty * max_tracked
+        self._heads = array("I", bytes(4 * max_tracked))
+        self._slots = OrderedDict()  # {(chat_id, user_id): slot}
+        self.flagged = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def hit(self, chat_id: int, user_id: int, now: float) -> bool:
+        key = (chat_id, user_id)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._allocate(key)
+        else:
+            self._slots.move_to_end(key)
+
+        head = self._heads[slot]
+        index = slot * self.limit + head
+        oldest = self._times[index]
+        self._times[index] = now
+        self._heads[slot] = head + 1 if head + 1 < self.limit else 0
+        if now - oldest < self.window:
+            self.flagged += 1
             return True
+        return False
+
+    def _allocate(self, key) -> int:
+        if len(self._slots) < self.max_tracked:
+            slot = len(self._slots)
+        else:
+            _, slot = self._slots.popitem(last=False)
+            self.evicted += 1
+            start = slot * self.limit
+            self._times[start:start + self.limit] = self._empty
+            self._heads[slot] = 0
+        self._slots[key] = slot
+        return slot
+
+flood_tracker = FloodTracker(FLOOD_MAX_MESSAGES, FLOOD_WINDOW_SECONDS, FLOOD_MAX_TRACKED)
+flood_penalized = OrderedDict()  # {(chat_id, user_id): penalty ends (monotonic)}
+# An album arrives as one message per item; only its first item is counted and
+# the rest share its verdict. {(chat_id, media_group_id): album was flooding}
+flood_media_groups = OrderedDict()
+
+async def flood_control(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
+    if not msg or not msg.from_user:
+        return
 
-    return False
+    # Channel auto-forwards and anonymous admins post as a chat, not a user
+    if msg.is_automatic_forward or msg.sender_chat:
+        return
 
-async def send_temp_warning(chat, text: str, seconds: int = 5):
-    warn = await chat.send_message(text)
-    await asyncio.sleep(seconds)
-    try:
-        await warn.delete()
-    except Exception:
-        pass
+    user = msg.from_user
+    if OWNER_ID and user.id == OWNER_ID:
+        return
+
+    album = (msg.chat_id, msg.media_group_id) if msg.media_group_id else None
+    if album in flood_media_groups:
+        if flood_media_groups[album]:
+            outbox.post(PRIORITY_MODERATION, None, msg.delete)
+            raise ApplicationHandlerStop
+        return
+
+    now = time.monotonic()
+    flooding = flood_tracker.hit(msg.chat_id, user.id, now)
+    # Only flooders pay for the admin lookup
+    if flooding and await get_member_status(context.bot, msg.chat_id, user.id) in ADMIN_STATUSES:
+        flooding = False
+    if album:
+        flood_media_groups[album] = flooding
+        while len(flood_media_groups) > 1000:
+            flood_media_groups.popitem(last=False)
+    if not flooding:
+        return
+
+    outbox.post(PRIORITY_MODERATION, None, msg.delete)
+
+    key = (msg.chat_id, user.id)
+    if FLOOD_ACTION != "delete" and flood_penalized.get(key, 0) < now:
+        flood_penalized[key] = now + FLOOD_PENALTY_SECONDS
+        flood_penalized.move_to_end(key)
+        while len(flood_penalized) > 10000:
+            flood_penalized.popitem(last=False)
+
+        if FLOOD_ACTION == "restrict":
+            # Text only: media, stickers and link previews are switched off
+            permissions = ChatPermissions(can_send_messages=True)
+        else:
+            permissions = ChatPermissions.no_permissions()
+        until = int(time.time()) + FLOOD_PENALTY_SECONDS
+        outbox.post(
+            PRIORITY_MODERATION, None,
+            lambda: context.bot.restrict_chat_member(
+                msg.chat_id, user.id, permissions, until_date=until
+            )
+        )
+        send_temp_warning(
+            msg.chat,
+            f"🚫 {user.first_name} is sending messages too fast "
+            f"({'muted' if FLOOD_ACTION == 'mute' else 'restricted'} for "
+            f"{FLOOD_PENALTY_SECONDS // 60} min)."
+        )
+
+    raise ApplicationHandlerStop
 
 
 async def moderate(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -71,24 +1038,17 @@ async def moderate(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Admin bypass
-    member = await context.bot.get_chat_member(msg.chat.id, user_id)
-    if member.status in ("administrator", "creator"):
+    status = await get_member_status(context.bot, msg.chat.id, user_id)
+    if status in ADMIN_STATUSES:
         return
 
     try:
-        if msg_is_forwarded(msg):
-            await msg.delete()
-            await send_temp_warning(
+        rule = moderation_pipeline.check(msg)
+        if rule:
+            outbox.post(PRIORITY_MODERATION, None, msg.delete)
+            send_temp_warning(
                 msg.chat,
-                "⚠️ Forwarded messages are not allowed."
-            )
-            return
-
-        if msg_has_link(msg):
-            await msg.delete()
-            await send_temp_warning(
-                msg.chat,
-                "🚫 Ads / links are not allowed."
+                RULE_WARNINGS.get(rule, DEFAULT_RULE_WARNING)
             )
             return
 
@@ -111,26 +1071,130 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "🔥 Enjoy the game and have fun!"
     )
 
-    await update.message.reply_text(start_message)
+    reply(update.message, start_message)
     
+# ===== WELCOME BATCHING =====
+WELCOME_DEBOUNCE_SECONDS = float(os.getenv("WELCOME_DEBOUNCE_SECONDS", "10"))
+WELCOME_MAX_NAMES = int(os.getenv("WELCOME_MAX_NAMES", "15"))
+WELCOME_DELETE_PREVIOUS = os.getenv("WELCOME_DELETE_PREVIOUS", "0") == "1"
+# A previous welcome is only deleted if it went out within this many windows.
+WELCOME_SPIKE_WINDOWS = 3
+
+def format_welcome(members) -> str:
+    shown = [
+        mention_html(user_id, (name or "Player").strip() or "Player")
+        for user_id, name in members[:WELCOME_MAX_NAMES]
+    ]
+    others = len(members) - len(shown)
+    if others:
+        names = ", ".join(shown) + f" and {others} other{'s' if others > 1 else ''}"
+    elif len(shown) > 1:
+        names = ", ".join(shown[:-1]) + " and " + shown[-1]
+    else:
+        names = shown[0]
+    return (
+        f"👋 Hello {names}, welcome to Palaro! 🎮🔥\n\n"
+        "📌 Please check the pinned rules before playing.\n"
+        "💬 Stay active and follow announcements for updates.\n\n"
+        "👉 If you haven't joined our main channel yet, join here:\n"
+        "https://t.me/+wkXVYyqiRYplZjk1"
+    )
+
+class WelcomeBatcher:
+    """Greets new members with one message per chat per debounce window.
+
+    The first join in a chat opens a window; everyone who joins before it
+    closes is greeted together. The window is not extended by later joins, so
+    a steady stream of joins still gets a welcome every few seconds. With
+    ``delete_previous`` a new welcome removes the chat's previous one if that
+    was sent during the same spike (within WELCOME_SPIKE_WINDOWS windows), so
+    a spike leaves a single greeting behind. If the previous welcome is still
+    queued in the outbox, it is deleted as soon as it has been sent.
+    """
+
+    def __init__(self, debounce: float, delete_previous: bool):
+        self.debounce = debounce
+        self.delete_previous = delete_previous
+        self._pending = {}  # {chat_id: (chat, [(user_id, name)])}
+        self._last = {}     # {chat_id: [flushed at, message_id or None until sent, superseded]}
+        self._tasks = set()
+        self.joins = 0
+        self.sent = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(members) for _, members in self._pending.values())
+
+    def add(self, chat, members):
+        self.joins += len(members)
+        entry = self._pending.get(chat.id)
+        if entry is not None:
+            entry[1].extend(members)
+            return
+        self._pending[chat.id] = (chat, list(members))
+        task = asyncio.create_task(self._flush_later(chat.id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_later(self, chat_id: int):
+        await asyncio.sleep(self.debounce)
+        self._flush(chat_id)
+
+    def _flush(self, chat_id: int):
+        entry = self._pending.pop(chat_id, None)
+        if not entry:
+            return
+        chat, members = entry
+        record = None
+        if self.delete_previous:
+            now = time.monotonic()
+            previous = self._last.pop(chat_id, None)
+            if previous and now - previous[0] <= self.debounce * WELCOME_SPIKE_WINDOWS:
+                if previous[1] is None:
+                    previous[2] = True
+                else:
+                    self._delete(chat, previous[1])
+            record = self._last[chat_id] = [now, None, False]
+
+        async def send():
+            sent = await chat.send_message(
+                format_welcome(members), parse_mode="HTML", disable_web_page_preview=True
+            )
+            if record is not None:
+                record[1] = sent.message_id
+                if record[2]:
+                    self._delete(chat, sent.message_id)
+            return sent
+        outbox.post(PRIORITY_CHATTER, chat_id, send)
+        self.sent += 1
+
+    @staticmethod
+    def _delete(chat, message_id: int):
+        outbox.post(
+            PRIORITY_CHATTER, None,
+            lambda: chat.get_bot().delete_message(chat.id, message_id)
+        )
+
+    async def stop(self):
+        # Greet whoever is still waiting; the outbox drains after this.
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for chat_id in list(self._pending):
+            self._flush(chat_id)
+
+welcome_batcher = WelcomeBatcher(WELCOME_DEBOUNCE_SECONDS, WELCOME_DELETE_PREVIOUS)
+
 async def welcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat = update.effective_chat
     msg = update.message
     if not msg or not msg.new_chat_members:
         return
 
-    for m in msg.new_chat_members:
-        full = (m.full_name or m.first_name or "Player").strip()
-
-        welcome_message = (
-            f"👋 Hello {full}, welcome to Palaro! 🎮🔥\n\n"
-            "📌 Please check the pinned rules before playing.\n"
-            "💬 Stay active and follow announcements for updates.\n\n"
-            "👉 If you haven't joined our main channel yet, join here:\n"
-            "https://t.me/+wkXVYyqiRYplZjk1"
-        )
+    welcome_batcher.add(
+        update.effective_chat,
+        [(m.id, m.full_name or m.first_name) for m in msg.new_chat_members]
+    )
 
-        await chat.send_message(welcome_message, disable_web_page_preview=True)
 # ===== /HELP COMMAND =====
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     help_text = (
@@ -161,19 +1225,152 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "🔥 Please follow the rules and have fun!"
     )
 
-    await update.message.reply_text(help_text, parse_mode="HTML")
-    
-import re
-import random
-from datetime import datetime
-import pytz
-from telegram import Update
-from telegram.ext import ContextTypes
-    
+    reply(update.message, help_text, parse_mode="HTML")
+
+# ===== /MODSTATS (OWNER ONLY) =====
+async def modstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not OWNER_ID or update.effective_user.id != OWNER_ID:
+        return
+
+    cache = member_cache.stats()
+    outbox_stats = outbox.stats()
+    updates = context.application.update_processor.stats()
+    reply(
+        update.message,
+        "📊 Moderation stats\n\n"
+        f"👥 Member cache: {cache['size']} entries\n"
+        f"✅ Hits: {cache['hits']} | ❌ Misses: {cache['misses']} "
+        f"({cache['hit_rate']:.0%})\n"
+        f"🗑️ Pending deletes: {deletion_scheduler.pending} "
+        f"(done {deletion_scheduler.deleted}, failed {deletion_scheduler.failed})\n"
+        f"🌊 Flood: {len(flood_tracker)} tracked, {flood_tracker.flagged} flagged, "
+        f"{flood_tracker.evicted} evicted\n"
+        f"🧬 Spam clusters: {len(spam_fingerprints)}, flagged {spam_fingerprints.flagged}\n"
+        f"🎲 Active games: {len(games)}\n"
+        f"🚀 Startup: {startup.total_ms:.0f} ms (budget {startup.budget_ms:.0f}) — "
+        + ", ".join(f"{k} {v:.0f}" for k, v in startup.phases.items()) + "\n"
+        f"👋 Welcomes: {welcome_batcher.sent} for {welcome_batcher.joins} joins, "
+        f"{welcome_batcher.pending} waiting\n"
+        f"📣 Report DMs: sent {report_desk.sent}, failed {report_desk.failed}, "
+        f"coalesced {report_desk.coalesced}\n"
+        f"📤 Outbox: {outbox_stats['pending']} queued {outbox_stats['depth']}, sent {outbox_stats['sent']}, "
+        f"429s {outbox_stats['retry_after']}, dropped {outbox_stats['dropped']}\n"
+        "⏱️ Queue wait avg/max ms: " + ", ".join(
+            f"{name} {outbox_stats['wait_avg_ms'][name]:.0f}/{outbox_stats['wait_max_ms'][name]:.0f}"
+            for name in PRIORITY_NAMES
+        ) + "\n"
+        f"⚙️ Updates: {updates['running']} running, {updates['queued']} queued in "
+        f"{updates['chats']} chats (max {updates['max_chat_queue']}), "
+        f"{updates['processed']} done\n\n"
+        "🧹 Rules (hits / calls, avg µs):\n"
+        + "\n".join(
+            f"• {name}: {hits} / {calls}, {ns / calls / 1000 if calls else 0:.1f}"
+            for name, (calls, hits, ns) in moderation_pipeline.stats.items()
+        )
+    )
+
+# ===== REPORT FAN-OUT =====
+REPORT_CONCURRENCY = int(os.getenv("REPORT_CONCURRENCY", "5"))
+REPORT_COALESCE_SECONDS = int(os.getenv("REPORT_COALESCE_SECONDS", "60"))
+REPORT_DIGEST_LINES = 20
+
+def format_report(chat, target: str, reason: str, reporter: str) -> str:
+    return (
+        "🚨 <b>Report Notification</b>\n\n"
+        f"👤 Reported user: {escape(target)}\n"
+        f"📝 Reason: {escape(reason)}\n"
+        f"🕵️ Reported by: {escape(reporter)}\n"
+        f"📍 Group: {escape(chat.title or '')}"
+    )
+
+def format_report_digest(chat, target: str, reports) -> str:
+    lines = [
+        f"• {escape(reason)} — {escape(reporter)}"
+        for reason, reporter in reports[:REPORT_DIGEST_LINES]
+    ]
+    if len(reports) > REPORT_DIGEST_LINES:
+        lines.append(f"… and {len(reports) - REPORT_DIGEST_LINES} more")
+    return (
+        "🚨 <b>Report Digest</b>\n\n"
+        f"👤 Reported user: {escape(target)}\n"
+        f"📍 Group: {escape(chat.title or '')}\n"
+        f"🔁 {len(reports)} more report(s) in the last {REPORT_COALESCE_SECONDS}s:\n"
+        + "\n".join(lines)
+    )
+
+class ReportDesk:
+    """Sends /report notices to every admin of a chat.
+
+    The first report about a user goes out at once. Repeats about the same user
+    in the same chat within the coalesce window are collected and delivered as
+    one digest per admin when the window closes. DMs go through the outbox
+    with bounded concurrency.
+    """
+
+    def __init__(self, window: float, concurrency: int):
+        self.window = window
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._open = {}     # {(chat_id, target): [(reason, reporter)]}
+        self._tasks = set()
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+
+    def submit(self, bot, chat, target: str, reason: str, reporter: str):
+        key = (chat.id, target.lower())
+        later = self._open.get(key)
+        if later is not None:
+            later.append((reason, reporter))
+            self.coalesced += 1
+            return
+        self._open[key] = []
+        task = asyncio.create_task(
+            self._run(bot, chat, key, target, format_report(chat, target, reason, reporter))
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, bot, chat, key, target: str, text: str):
+        try:
+            await self._fan_out(bot, chat.id, text)
+            await asyncio.sleep(self.window)
+        finally:
+            later = self._open.pop(key, None)
+        if later:
+            await self._fan_out(bot, chat.id, format_report_digest(chat, target, later))
+
+    async def _fan_out(self, bot, chat_id: int, text: str):
+        try:
+            admin_ids = await admin_roster.get(bot, chat_id)
+        except Exception as e:
+            print("report admins error:", e)
+            return
+        await asyncio.gather(*(self._send(bot, admin_id, text) for admin_id in admin_ids))
+
+    async def _send(self, bot, admin_id: int, text: str):
+        # RetryAfter is retried by the outbox; anything else is usually an
+        # admin who never started a chat with the bot.
+        async with self._semaphore:
+            try:
+                sent = await outbox.send(
+                    PRIORITY_MODERATION, admin_id,
+                    lambda: bot.send_message(admin_id, text, parse_mode="HTML")
+                )
+            except Exception as e:
+                sent = None
+                print("report DM error:", admin_id, e)
+            if sent:
+                self.sent += 1
+            else:
+                self.failed += 1
+
+report_desk = ReportDesk(REPORT_COALESCE_SECONDS, REPORT_CONCURRENCY)
+
 async def report_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     if not msg or not context.args:
-        await msg.reply_text(
+        reply(
+            msg,
             "⚠️ Usage:\n/report @username reason\nExample: /report @user spamming links"
         )
         return
@@ -186,200 +1383,428 @@ async def report_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reporter_name = update.effective_user.full_name or update.effective_user.username
 
     # Confirm to reporter (member)
-    await msg.reply_text("✅ Your report has been sent to the admins Owner.")
-
-    # Get admins
-    admins = await context.bot.get_chat_administrators(chat.id)
-
-    for admin in admins:
-        if admin.user.is_bot:
-            continue
-        try:
-            await context.bot.send_message(
-                admin.user.id,
-                f"🚨 *Report Notification*\n\n"
-                f"👤 Reported user: {reported_user}\n"
-                f"📝 Reason: {reason}\n"
-                f"🕵️ Reported by: {reporter_name}\n"
-                f"📍 Group: {chat.title}",
-                parse_mode="Markdown"
-            )
-        except:
-           pass
+    reply(msg, "✅ Your report has been sent to the admins Owner.")
 
-import random
-import asyncio
-from telegram import Update
-from telegram.ext import (
-    Application,
-    CommandHandler,
-    MessageHandler,
-    ContextTypes,
-    filters
-)
+    # Fan-out runs in the background so the handler returns right away
+    report_desk.submit(context.bot, chat, reported_user, reason, reporter_name)
 
 # ================= CONFIG =================
 MAX_PLAYERS = 6
 ROLL_WAIT_SECONDS = 0
 
 # ================= GLOBAL GAME STATE =================
-picks = {}                  # {user_id: number}
 roll_enabled = True
-pending_game = False
-roll_cooldown_active = False
-roll_cooldown_task = None
 WINNER_DM = "@KAZEHAYAMODZ"
+GAME_IDLE_SECONDS = int(os.getenv("GAME_IDLE_SECONDS", "21600"))
+RESOLVE_MISSING_MENTIONS = os.getenv("RESOLVE_MISSING_MENTIONS", "1") == "1"
+MENTION_RESOLVE_TIMEOUT = float(os.getenv("MENTION_RESOLVE_TIMEOUT", "2"))
 
 
-# ================= HELPER: CHECK ADMIN =================
-async def is_admin(update, context):
-    member = await context.bot.get_chat_member(
-        update.effective_chat.id,
-        update.effective_user.id
-    )
-    return member.status in ["administrator", "creator"]
+# ================= PER-CHAT DICE GAME =================
+class DiceGame:
+    """Dice game state for one chat.
 
+    Taken numbers live in a 6-bit mask and ``owners[n]`` holds the user who
+    picked ``n``, so picking, duplicate checks and winner lookup are all O(1).
+    ``mentions[n]`` keeps the player's mention markup from pick time so the
+    result can be announced without looking anyone up.
+    """
 
-# ================= AUTO DETECT + PICK =================
-import re
-from datetime import datetime
-import pytz
+    __slots__ = (
+        "chat_id", "taken", "owners", "mentions", "pending",
+        "cooldown_active", "cooldown_task", "last_active",
+    )
 
-async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global pending_game, roll_cooldown_active
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.taken = 0                  # bit n-1 set when number n is picked
+        self.owners = [None] * 7        # [unused, user for 1, ..., user for 6]
+        self.mentions = [None] * 7      # HTML mention for each owner
+        self.pending = False
+        self.cooldown_active = False
+        self.cooldown_task = None
+        self.last_active = time.monotonic()
+
+    @property
+    def player_count(self) -> int:
+        return self.taken.bit_count()
+
+    @property
+    def busy(self) -> bool:
+        return self.pending or self.cooldown_active
+
+    def has_player(self, user_id: int) -> bool:
+        return user_id in self.owners
+
+    def is_taken(self, number: int) -> bool:
+        return bool(self.taken >> (number - 1) & 1)
+
+    def pick(self, user_id: int, number: int, mention: str = None):
+        self.taken |= 1 << (number - 1)
+        self.owners[number] = user_id
+        self.mentions[number] = mention
+
+    def winner(self, number: int):
+        return self.owners[number]
+
+    def reset(self):
+        self.taken = 0
+        self.owners = [None] * 7
+        self.mentions = [None] * 7
+        self.pending = False
+
+    def is_idle(self, now: float) -> bool:
+        return (
+            not self.taken
+            and not self.busy
+            and now - self.last_active > GAME_IDLE_SECONDS
+        )
 
-    msg = update.message
-    if not msg or not msg.text:
-        return
 
-    text = msg.text.strip()
-    text_lower = text.lower()
-    user = update.effective_user
-    user_id = user.id
+class GameRegistry:
+    """Per-chat ``DiceGame`` instances; empty games idle past GAME_IDLE_SECONDS are dropped."""
+
+    SWEEP_INTERVAL = 60
+
+    def __init__(self):
+        self._games = {}  # {chat_id: DiceGame}
+        self._next_sweep = time.monotonic() + self.SWEEP_INTERVAL
+
+    def __len__(self):
+        return len(self._games)
+
+    def items(self):
+        return self._games.items()
+
+    def get(self, chat_id: int) -> DiceGame:
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self.sweep(now)
+        game = self._games.get(chat_id)
+        if game is None:
+            game = self._games[chat_id] = DiceGame(chat_id)
+        game.last_active = now
+        return game
+
+    def sweep(self, now: float):
+        self._next_sweep = now + self.SWEEP_INTERVAL
+        for chat_id in [c for c, g in self._games.items() if g.is_idle(now)]:
+            del self._games[chat_id]
+
+games = GameRegistry()
+
+
+# ================= GAME STATE JOURNAL =================
+STATE_DIR = os.getenv("STATE_DIR", "state")
+SNAPSHOT_EVERY = int(os.getenv("SNAPSHOT_EVERY", "1000"))
+
+def apply_game_event(event):
+    # Every event assigns state outright (no increments), so replaying events
+    # that are already part of the snapshot is harmless.
+    global roll_enabled, WINNER_DM
+    kind = event[0]
+    if kind == "pick":
+        _, chat_id, number, user_id, mention = event
+        games.get(chat_id).pick(user_id, number, mention)
+    elif kind == "reset":
+        games.get(event[1]).reset()
+    elif kind == "pending":
+        games.get(event[1]).pending = event[2]
+    elif kind == "roll_enabled":
+        roll_enabled = event[1]
+    elif kind == "winner_dm":
+        WINNER_DM = event[1]
+
+def export_game_state() -> dict:
+    return {
+        "roll_enabled": roll_enabled,
+        "winner_dm": WINNER_DM,
+        "games": {
+            # Copies: the writer thread serializes this while handlers keep playing
+            str(chat_id): {"owners": list(g.owners), "mentions": list(g.mentions), "pending": g.pending}
+            for chat_id, g in games.items()
+            if g.taken or g.pending
+        },
+    }
+
+def import_game_state(state: dict):
+    global roll_enabled, WINNER_DM
+    roll_enabled = state.get("roll_enabled", roll_enabled)
+    WINNER_DM = state.get("winner_dm", WINNER_DM)
+    for chat_id, saved in state.get("games", {}).items():
+        game = games.get(int(chat_id))
+        game.reset()
+        for number in range(1, 7):
+            if saved["owners"][number] is not None:
+                game.pick(saved["owners"][number], number, saved["mentions"][number])
+        game.pending = saved["pending"]
+
+
+class GameJournal:
+    """Append-only journal of game events with periodic compact snapshots.
+
+    ``record()`` only puts a tuple on a queue. A writer thread encodes events
+    onto ``journal.log``. Every ``snapshot_every`` events a copy of the state
+    is queued behind them; the thread writes it atomically to
+    ``snapshot.json`` and truncates the log. ``restore()`` loads the snapshot
+    and replays the log tail.
+    """
+
+    _STOP = object()
+
+    def __init__(self, directory: str, snapshot_every: int):
+        self.dir = Path(directory)
+        self.snapshot_path = self.dir / "snapshot.json"
+        self.log_path = self.dir / "journal.log"
+        self.snapshot_every = snapshot_every
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._since_snapshot = 0
+        self.events = 0
+
+    def record(self, *event):
+        self._queue.put(event)
+        self.events += 1
+        self._since_snapshot += 1
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        self._since_snapshot = 0
+        self._queue.put(export_game_state())
+
+    def restore(self) -> int:
+        """Load snapshot + journal tail into the game state; returns events replayed."""
+        if self.snapshot_path.exists():
+            import_game_state(json.loads(self.snapshot_path.read_text()))
+        replayed = 0
+        if self.log_path.exists():
+            with open(self.log_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        break  # torn last line from a crash
+                    apply_game_event(event)
+                    replayed += 1
+        return replayed
+
+    def start(self):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._thread = Thread(target=self._writer, name="game-journal", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._thread:
+            self.snapshot()
+            self._queue.put(self._STOP)
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    def _writer(self):
+        log = open(self.log_path, "a", encoding="utf-8")
+        try:
+            while True:
+                item = self._queue.get()
+                batch = [item]
+                while not self._queue.empty():
+                    batch.append(self._queue.get())
+                for item in batch:
+                    if item is self._STOP:
+                        return
+                    try:
+                        if isinstance(item, dict):
+                            log.flush()
+                            self._write_snapshot(item)
+                            log.truncate(0)
+                        else:
+                            log.write(json.dumps(item) + "\n")
+                    except Exception as e:
+                        print("journal error:", e)
+                log.flush()
+        finally:
+            log.close()
 
-    # ===== NAMES / SPECIAL =====
-    if re.search(r"\bkaze+\b", text_lower):
-        await msg.reply_text(" Pogi si Kaze!")
-        return
+    def _write_snapshot(self, state: dict):
+        tmp = self.snapshot_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
 
-    if re.search(r"\bkuri\b", text_lower):
-        await msg.reply_text(" Pogi")
-        return
+game_journal = GameJournal(STATE_DIR, SNAPSHOT_EVERY)
 
-    if re.search(r"\bphia\b", text_lower):
-        await msg.reply_text("🥹 Phia maganda")
-        return
 
-    # ===== GREETINGS =====
-    if re.search(r"\b(hi|hello|hey|yo|hoy)\b", text_lower):
-        await msg.reply_text("👋 Hi! Kumusta ka?")
-        return
+# ================= HELPER: CHECK ADMIN =================
+async def is_admin(update, context):
+    status = await get_member_status(
+        context.bot,
+        update.effective_chat.id,
+        update.effective_user.id
+    )
+    return status in ADMIN_STATUSES
 
-    # ===== THANK YOU =====
-    if re.search(r"\b(thanks|thank you|thx|salamat)\b", text_lower):
-        await msg.reply_text("🙏 Walang anuman! 😊")
-        return
 
-    # ===== GOOD NIGHT =====
-    if re.search(r"\b(good night|gn|gabing gabi)\b", text_lower):
-        await msg.reply_text("🌙 Good night too 😴")
-        return
+# ================= KEYWORD RESPONDERS =================
+MANILA_TZ = None
 
-    # ===== GOOD MORNING =====
-    if re.search(r"\b(good morning|gm|umaga na)\b", text_lower):
-        await msg.reply_text("☀️ Good morning too! 😏")
-        return
+def time_check_reply():
+    # pytz is loaded the first time someone asks for the time, not at startup.
+    global MANILA_TZ
+    if MANILA_TZ is None:
+        import pytz
+        MANILA_TZ = pytz.timezone("Asia/Manila")
+    now = datetime.now(MANILA_TZ)
+    return f"⏰ Time check: **{now.strftime('%I:%M %p')}**"
 
+# (priority, pattern, reply, parse_mode) – lowest priority wins when several match.
+# A reply may be a callable for answers computed at send time.
+RESPONDERS = [
+    # ===== NAMES / SPECIAL =====
+    (0, r"\bkaze+\b", " Pogi si Kaze!", None),
+    (1, r"\bkuri\b", " Pogi", None),
+    (2, r"\bphia\b", "🥹 Phia maganda", None),
+    # ===== GREETINGS =====
+    (3, r"\b(hi|hello|hey|yo|hoy)\b", "👋 Hi! Kumusta ka?", None),
+    # ===== THANK YOU =====
+    (4, r"\b(thanks|thank you|thx|salamat)\b", "🙏 Walang anuman! 😊", None),
+    # ===== GOOD NIGHT / GOOD MORNING =====
+    (5, r"\b(good night|gn|gabing gabi)\b", "🌙 Good night too 😴", None),
+    (6, r"\b(good morning|gm|umaga na)\b", "☀️ Good morning too! 😏", None),
     # ===== WHAT TIME =====
-    if re.search(r"\b(anong oras na ba|what time is it|time)\b", text_lower):
-        tz = pytz.timezone("Asia/Manila")
-        now = datetime.now(tz)
-        time_now = now.strftime("%I:%M %p")
-        await msg.reply_text(f"⏰ Time check: **{time_now}**", parse_mode="Markdown")
-        return
-
+    (7, r"\b(anong oras na ba|what time is it|time)\b", time_check_reply, "Markdown"),
     # ===== BOT INFO =====
-    if re.search(r"\b(ano ang pangalan mo|who are you)\b", text_lower):
-        await msg.reply_text("🤖 Ako si Kazebot!")
-        return
-
+    (8, r"\b(ano ang pangalan mo|who are you)\b", "🤖 Ako si Kazebot!", None),
     # ===== FUN =====
-    if re.search(r"\b(gg|good game)\b", text_lower):
-        await msg.reply_text("🎮 GG! Nice play!")
-        return
+    (9, r"\b(gg|good game)\b", "🎮 GG! Nice play!", None),
+    (10, r"\bpalaro\b", " Mga kupal", None),
+]
+
+PICK_NUMBERS = frozenset({"1", "2", "3", "4", "5", "6"})
+
+def compile_responders(responders):
+    ordered = sorted(responders, key=lambda r: r[0])
+    for _, pattern, _, _ in ordered:
+        if not pattern.startswith(r"\b"):
+            raise ValueError(f"responder pattern must start with \\b: {pattern!r}")
+    alternatives = "|".join(
+        f"(?P<r{i}>{pattern})" for i, (_, pattern, _, _) in enumerate(ordered)
+    )
+    # The zero-width lookahead tries every word boundary without consuming text, so
+    # a lower-priority hit can never swallow an overlapping higher-priority one.
+    return re.compile(rf"\b(?=(?:{alternatives}))"), ordered
+
+RESPONDER_RE, RESPONDER_TABLE = compile_responders(RESPONDERS)
 
-    if re.search(r"\bpalaro\b", text_lower):
-        await msg.reply_text(" Mga kupal")
+def match_responder(text_lower: str):
+    best = None
+    for m in RESPONDER_RE.finditer(text_lower):
+        idx = int(m.lastgroup[1:])
+        if best is None or idx < best:
+            best = idx
+            if idx == 0:
+                break
+    return None if best is None else RESPONDER_TABLE[best]
+
+
+# ================= AUTO DETECT + PICK =================
+async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
+    if not msg or not msg.text:
         return
 
+    text = msg.text.strip()
+    text_lower = text.lower()
+    user = update.effective_user
+    user_id = user.id
+
     # ===== PICK NUMBER (1–6 ONLY) =====
-    if text_lower not in ["1", "2", "3", "4", "5", "6"]:
+    # Picks are checked before any regex runs; they can never match a responder.
+    if text_lower not in PICK_NUMBERS:
+        responder = match_responder(text_lower)
+        if responder:
+            _, _, answer, parse_mode = responder
+            reply(
+                msg, answer() if callable(answer) else answer,
+                PRIORITY_CHATTER, parse_mode=parse_mode
+            )
         return
 
-    if pending_game or roll_cooldown_active:
-        warn = await msg.reply_text("⏳ Game in progress. Please wait.")
-        await asyncio.sleep(3)
-        await warn.delete()
+    game = games.get(msg.chat.id)
+    if game.busy:
+        reply_temp(msg, "⏳ Game in progress. Please wait.")
         return
 
     # 🔒 ONE PICK ONLY
-    if user_id in picks:
-        warn = await msg.reply_text(
-            "🚫 You already picked.\nPlease wait for the game to finish."
-        )
-        await asyncio.sleep(3)
-        await warn.delete()
+    if game.has_player(user_id):
+        reply_temp(msg, "🚫 You already picked.\nPlease wait for the game to finish.")
         return
 
     number = int(text_lower)
 
     # ❌ DUPLICATE NUMBER
-    if number in picks.values():
-        warn = await msg.reply_text(
-            "❌ That number is already taken.\nChoose another."
-        )
-        await asyncio.sleep(3)
-        await warn.delete()
+    if game.is_taken(number):
+        reply_temp(msg, "❌ That number is already taken.\nChoose another.")
         return
 
     # ✅ SUCCESS PICK
-    picks[user_id] = number
-    confirm = await msg.reply_text(
-        f"✅ {user.first_name}, your pick is locked: [{number}] 🔒"
+    mention = user.mention_html()
+    game.pick(user_id, number, mention)
+    game_journal.record("pick", game.chat_id, number, user_id, mention)
+    reply_temp(
+        msg, f"✅ {user.first_name}, your pick is locked: [{number}] 🔒"
     )
-    await asyncio.sleep(3)
-    await confirm.delete()
     
 # ================= CORE ROLL =================
-async def process_roll(update: Update, context: ContextTypes.DEFAULT_TYPE, is_reroll=False):
-    global pending_game, picks, WINNER_DM
-
+async def resolve_mentions(bot, chat_id: int, user_ids, timeout: float = MENTION_RESOLVE_TIMEOUT) -> dict:
+    # Fallback for picks recorded without a mention; lookups run concurrently
+    # and anything slower than the timeout is left out.
+    async def lookup(uid):
+        member = await bot.get_chat_member(chat_id, uid)
+        return uid, member.user.mention_html()
+
+    tasks = [asyncio.create_task(lookup(uid)) for uid in user_ids]
+    if not tasks:
+        return {}
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    return dict(t.result() for t in done if not t.exception())
+
+async def process_roll(update: Update, context: ContextTypes.DEFAULT_TYPE, game: DiceGame, is_reroll=False):
     dice = random.randint(1, 6)
     winners = []
 
-    for uid, num in picks.items():
-        if num == dice:
-            member = await context.bot.get_chat_member(
-                update.effective_chat.id, uid
-            )
-            winners.append(member.user.mention_html())
+    uid = game.winner(dice)
+    if uid is not None:
+        mention = game.mentions[dice]
+        if mention is None and RESOLVE_MISSING_MENTIONS:
+            resolved = await resolve_mentions(context.bot, game.chat_id, [uid])
+            mention = resolved.get(uid)
+        winners.append(mention or mention_html(uid, "Player"))
 
     # ===== IF MAY WINNER =====
     if winners:
-        await update.message.reply_html(
+        winner_lines = "\n".join(winners)
+        reply(
+            update.message,
             f"🎲 <b>{'Re' if is_reroll else ''}Rolled Number:</b> {dice}\n\n"
             f"🎉 <b>WINNER(S):</b>\n"
-            f"{'<br>'.join(winners)}\n\n"
-            f"📩 DM {WINNER_DM}"
+            f"{winner_lines}\n\n"
+            f"📩 DM {WINNER_DM}",
+            parse_mode="HTML"
         )
 
-        picks.clear()
-        pending_game = False
+        game.reset()
+        game_journal.record("reset", game.chat_id)
 
     # ===== NO WINNER =====
     else:
-        pending_game = True
-        await update.message.reply_text(
+        game.pending = True
+        game_journal.record("pending", game.chat_id, True)
+        reply(
+            update.message,
             f"🎲 Rolled Number: {dice}\n"
             f"🥹 No winners.\n\n"
             f"🔁 Use /reroll"
@@ -388,65 +1813,66 @@ async def process_roll(update: Update, context: ContextTypes.DEFAULT_TYPE, is_re
 
 # ================= /roll =================
 async def roll(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global roll_enabled, roll_cooldown_active, roll_cooldown_task
+    game = games.get(update.effective_chat.id)
 
     if not roll_enabled:
-        await update.message.reply_text("⛔ Roll is disabled.")
+        reply(update.message, "⛔ Roll is disabled.")
         return
 
-    if pending_game or roll_cooldown_active:
-        await update.message.reply_text("⏳ Please wait.")
+    if game.busy:
+        reply(update.message, "⏳ Please wait.")
         return
 
-    if len(picks) < 2:
-        await update.message.reply_text("❌ At least 2 players required.")
+    if game.player_count < 2:
+        reply(update.message, "❌ At least 2 players required.")
         return
 
-    if len(picks) >= MAX_PLAYERS:
-        await update.message.reply_text("🔥 Full players! Rolling now...")
-        await process_roll(update, context)
+    if game.player_count >= MAX_PLAYERS:
+        reply(update.message, "🔥 Full players! Rolling now...")
+        await process_roll(update, context, game)
         return
 
-    roll_cooldown_active = True
-    await update.message.reply_text(
+    game.cooldown_active = True
+    reply(
+        update.message,
         f"⏳ Please wait {ROLL_WAIT_SECONDS}s.\nWaiting for other players..."
     )
 
     async def delayed_roll():
-        global roll_cooldown_active
         try:
             await asyncio.sleep(ROLL_WAIT_SECONDS)
-            if not pending_game and roll_enabled:
-                await process_roll(update, context)
+            if not game.pending and roll_enabled:
+                await process_roll(update, context, game)
         finally:
-            roll_cooldown_active = False
+            game.cooldown_active = False
 
-    roll_cooldown_task = asyncio.create_task(delayed_roll())
+    game.cooldown_task = asyncio.create_task(delayed_roll())
 
 
 # ================= /reroll =================
 async def reroll(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not pending_game:
-        await update.message.reply_text("❌ No pending game.")
+    game = games.get(update.effective_chat.id)
+    if not game.pending:
+        reply(update.message, "❌ No pending game.")
         return
-    await process_roll(update, context, is_reroll=True)
+    await process_roll(update, context, game, is_reroll=True)
 
 
 # ================= /cancelroll =================
 async def cancelroll(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global picks, pending_game, roll_cooldown_active, roll_cooldown_task
-
     if not await is_admin(update, context):
         return
 
-    if roll_cooldown_task:
-        roll_cooldown_task.cancel()
+    game = games.get(update.effective_chat.id)
+    if game.cooldown_task:
+        game.cooldown_task.cancel()
 
-    picks.clear()
-    pending_game = False
-    roll_cooldown_active = False
+    game.reset()
+    game.cooldown_active = False
+    game_journal.record("reset", game.chat_id)
 
-    await update.message.reply_text(
+    reply(
+        update.message,
         "🛑 Game cancelled.\n🔄 Game reset."
     )
 
@@ -456,7 +1882,8 @@ async def stoproll(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global roll_enabled
     if await is_admin(update, context):
         roll_enabled = False
-        await update.message.reply_text("⛔ Roll stopped.")
+        game_journal.record("roll_enabled", False)
+        reply(update.message, "⛔ Roll stopped.")
 
 
 # ================= /runroll =================
@@ -464,7 +1891,8 @@ async def runroll(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global roll_enabled
     if await is_admin(update, context):
         roll_enabled = True
-        await update.message.reply_text("▶️ Roll enabled!")
+        game_journal.record("roll_enabled", True)
+        reply(update.message, "▶️ Roll enabled!")
 
 async def switch_kaze(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global WINNER_DM
@@ -472,9 +1900,8 @@ async def switch_kaze(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # OWNER always allowed
     if OWNER_ID and update.effective_user.id == OWNER_ID:
         WINNER_DM = "@KAZEHAYAMODZ"
-        msg = await update.message.reply_text("✅ Switch Successfully")
-        await asyncio.sleep(3)
-        await msg.delete()
+        game_journal.record("winner_dm", WINNER_DM)
+        reply_temp(update.message, "✅ Switch Successfully")
         return
 
     # Admin only
@@ -482,9 +1909,8 @@ async def switch_kaze(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     WINNER_DM = "@KAZEHAYAMODZ"
-    msg = await update.message.reply_text("✅ Switch Successfully")
-    await asyncio.sleep(3)
-    await msg.delete()
+    game_journal.record("winner_dm", WINNER_DM)
+    reply_temp(update.message, "✅ Switch Successfully")
 
 async def switch_kuri(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global WINNER_DM
@@ -492,9 +1918,8 @@ async def switch_kuri(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # OWNER always allowed
     if OWNER_ID and update.effective_user.id == OWNER_ID:
         WINNER_DM = "@Kurikongofficial"
-        msg = await update.message.reply_text("✅ Switch Successfully")
-        await asyncio.sleep(3)
-        await msg.delete()
+        game_journal.record("winner_dm", WINNER_DM)
+        reply_temp(update.message, "✅ Switch Successfully")
         return
 
     # Admin only
@@ -502,22 +1927,377 @@ async def switch_kuri(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     WINNER_DM = "@Kurikongofficial"
-    msg = await update.message.reply_text("✅ Switch Successfully")
-    await asyncio.sleep(3)
-    await msg.delete()
+    game_journal.record("winner_dm", WINNER_DM)
+    reply_temp(update.message, "✅ Switch Successfully")
     
-# ===== MAIN FUNCTION =====
-def main():
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
-    if not token:
-        raise RuntimeError("Missing TELEGRAM_TOKEN env var.")
+# ===== LIFECYCLE =====
+async def post_init(app: Application):
+    started = time.perf_counter()
+    replayed = game_journal.restore()
+    print(f"Game state restored ({replayed} journal events) in "
+          f"{(time.perf_counter() - started) * 1000:.1f} ms")
+    game_journal.start()
+    metrics.loop = asyncio.get_running_loop()
+    outbox.start()
+    deletion_scheduler.start(app.bot)
+    startup.mark("init")
+
+async def post_stop(app: Application):
+    await welcome_batcher.stop()
+    await deletion_scheduler.stop()
+    await outbox.stop()
+    await game_journal.stop()
+
+# ===== CONCURRENT UPDATE PROCESSING =====
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "4096"))
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently while keeping each chat's updates in order.
+
+    Updates for the same chat wait on a FIFO lock, so moderation and game picks
+    stay ordered. Different chats run in parallel, with at most ``concurrency``
+    handlers running at once. The slot is taken after the chat lock, so a busy
+    chat can't block other chats by holding slots it is waiting on.
+    ``max_concurrent_updates`` limits how many updates may be admitted (running or
+    queued) at a time.
+    """
+
+    def __init__(self, concurrency: int, max_pending: int):
+        super().__init__(max(max_pending, concurrency, 2))
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+        self._chats = {}  # {chat_id: [lock, queued]}
+        self.running = 0
+        self.processed = 0
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            async with self._slots:
+                await self._run(coroutine)
+            return
+
+        entry = self._chats.get(chat.id)
+        if entry is None:
+            entry = self._chats[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat.id]
 
-    app = Application.builder().token(token).build()
+    async def _run(self, coroutine):
+        self.running += 1
+        try:
+            await coroutine
+        finally:
+            self.running -= 1
+            if not self.processed:
+                startup.mark("first_update")
+            self.processed += 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def queue_lengths(self) -> dict:
+        """{chat_id: updates queued or running} for chats with work in flight."""
+        return {chat_id: queued for chat_id, (_, queued) in self._chats.items()}
+
+    def stats(self) -> dict:
+        lengths = self.queue_lengths()
+        return {
+            "running": self.running,
+            "processed": self.processed,
+            "chats": len(lengths),
+            "queued": sum(lengths.values()),
+            "max_chat_queue": max(lengths.values(), default=0),
+        }
+
+# ===== WEBHOOK SERVER =====
+# Set WEBHOOK_URL (public https base) to serve updates by webhook instead of polling.
+# The webhook, "/" health check and any other GET routes share one asyncio server
+# on PORT. To try it locally without registering the webhook with Telegram:
+#   WEBHOOK_URL=http://localhost WEBHOOK_SET=0 WEBHOOK_SECRET=s python Bot_for_channel.py
+#   curl -H "X-Telegram-Bot-Api-Secret-Token: s" -d @update.json localhost:10000/telegram
+# WEBHOOK_SECRET is required: without it anyone could post forged updates.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_SET = os.getenv("WEBHOOK_SET", "1") == "1"
+WEBHOOK_MAX_BODY = 1 << 20
+WEBHOOK_IDLE_TIMEOUT = 75
+WEBHOOK_READ_TIMEOUT = 10
+WEBHOOK_MAX_HEADERS = 100
+
+HTTP_REASONS = {
+    200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+}
+
+class WebhookServer:
+    """Tiny HTTP/1.1 server for the Telegram webhook and plain-text GET routes.
+
+    Updates that pass the secret-token check are decoded and put on the
+    application's update queue; the response is sent without waiting for
+    handlers to run.
+    """
+
+    def __init__(self, app: Application, path: str, secret: str):
+        self.app = app
+        self.path = path
+        self.secret = secret.encode()
+        self.routes = {  # {path: () -> str}
+            "/": lambda: "Bot is online!",
+            "/metrics": metrics.render,
+        }
+        self.private_routes = {"/metrics"}
+        self.received = 0
+        self.rejected = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                # A keep-alive connection may sit idle between requests, but
+                # once a request starts it has to arrive in full within
+                # WEBHOOK_READ_TIMEOUT, so a stalled client can't hold it open.
+                first = await asyncio.wait_for(reader.read(1), WEBHOOK_IDLE_TIMEOUT)
+                if not first:
+                    break
+                request = await asyncio.wait_for(self._read_request(reader, first), WEBHOOK_READ_TIMEOUT)
+                if isinstance(request, int):
+                    self._respond(writer, request, "", close=True)
+                    await writer.drain()
+                    break
+                method, target, headers, body = request
+                status, payload = await self.dispatch(method, target.split("?", 1)[0], headers, body)
+                close = headers.get("connection", "").lower() == "close"
+                self._respond(writer, status, payload, close)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader, first: bytes):
+        """Return (method, target, headers, body), or an error status to send before closing."""
+        request_line = first + await reader.readline()
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        for _ in range(WEBHOOK_MAX_HEADERS + 1):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            return 431
+
+        length = int(headers.get("content-length") or 0)
+        if length > WEBHOOK_MAX_BODY:
+            return 413
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, body
+
+    async def dispatch(self, method: str, path: str, headers: dict, body: bytes):
+        if path == self.path:
+            if method != "POST":
+                return 405, ""
+            token = headers.get("x-telegram-bot-api-secret-token", "").encode()
+            if not self.secret or not hmac.compare_digest(token, self.secret):
+                self.rejected += 1
+                return 403, ""
+            try:
+                data = json.loads(body)
+                if not isinstance(data, dict) or type(data.get("update_id")) is not int:
+                    return 400, ""
+                update = Update.de_json(data, self.app.bot)
+            except (ValueError, TypeError, KeyError, AttributeError):
+                return 400, ""
+            self.received += 1
+            await self.app.update_queue.put(update)
+            return 200, ""
+        route = self.routes.get(path)
+        if route is None:
+            return 404, ""
+        if method != "GET":
+            return 405, ""
+        if path in self.private_routes:
+            status = metrics_auth_status(headers.get("authorization", ""))
+            if status != 200:
+                return status, ""
+        return 200, route()
+
+    @staticmethod
+    def _respond(writer, status: int, payload: str, close: bool = False):
+        body = payload.encode()
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode()
+            + body
+        )
+
+async def run_webhook(app: Application):
+    server = WebhookServer(app, WEBHOOK_PATH, WEBHOOK_SECRET)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    http = await asyncio.start_server(server.handle, "0.0.0.0", PORT)
+    if WEBHOOK_SET:
+        await app.bot.set_webhook(
+            WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    await app.start()
+    print(f"Webhook server listening on :{PORT}{WEBHOOK_PATH}")
+    try:
+        await stop.wait()
+    finally:
+        http.close()
+        await http.wait_closed()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+# ===== INSTRUMENTATION =====
+class InstrumentedRequest(BaseRequest):
+    """Wraps the real request backend and records every outbound Bot API call."""
+
+    def __init__(self, inner: BaseRequest):
+        self._inner = inner
+
+    @property
+    def read_timeout(self):
+        return self._inner.read_timeout
+
+    async def initialize(self):
+        await self._inner.initialize()
+
+    async def shutdown(self):
+        await self._inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        endpoint = url.rsplit("/", 1)[-1]
+        chat_id = request_data.parameters.get("chat_id") if request_data else None
+        labels = (("method", endpoint), ("chat", metrics.chat_label(chat_id)))
+        started = time.perf_counter()
+        try:
+            code, payload = await self._inner.do_request(url, method, request_data, **timeouts)
+        except Exception:
+            metrics.inc("bot_api_errors_total", labels)
+            raise
+        finally:
+            metrics.observe("bot_api_seconds", (("method", endpoint),), time.perf_counter() - started)
+            metrics.inc("bot_api_calls_total", labels)
+        if code == 429:
+            metrics.inc("bot_api_rate_limited_total", labels)
+        elif code >= 400:
+            metrics.inc("bot_api_errors_total", labels)
+        return code, payload
+
+def timed_handler(callback):
+    name = callback.__name__
+
+    async def wrapper(update, context):
+        chat = getattr(update, "effective_chat", None)
+        labels = (("handler", name), ("chat", metrics.chat_label(chat.id if chat else None)))
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            metrics.inc("bot_handler_errors_total", labels)
+            raise
+        finally:
+            metrics.observe("bot_handler_seconds", (("handler", name),), time.perf_counter() - started)
+            metrics.inc("bot_handler_calls_total", labels)
+
+    wrapper.__name__ = name
+    return wrapper
+
+def instrument(app: Application):
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            handler.callback = timed_handler(handler.callback)
+
+    processor = app.update_processor
+    metrics.collect("bot_updates_in_flight", "gauge", "Updates running or queued.",
+                    lambda: {(("state", "running"),): processor.running,
+                             (("state", "queued"),): processor.stats()["queued"]})
+    metrics.collect("bot_outbox_depth", "gauge", "Queued outbound calls by priority.",
+                    lambda: {(("priority", k),): v for k, v in outbox.stats()["depth"].items()})
+    metrics.collect("bot_outbox_dropped_total", "counter", "Outbound calls shed by priority.",
+                    lambda: {(("priority", k),): v for k, v in outbox.stats()["dropped"].items()})
+    metrics.collect("bot_outbox_wait_seconds_max", "gauge", "Longest queue wait by priority.",
+                    lambda: {(("priority", k),): v / 1000 for k, v in outbox.stats()["wait_max_ms"].items()})
+    metrics.collect("bot_member_cache_total", "counter", "Member status cache lookups.",
+                    lambda: {(("result", "hit"),): member_cache.hits,
+                             (("result", "miss"),): member_cache.misses})
+    metrics.collect("bot_moderation_rule_hits_total", "counter", "Moderation rule hits.",
+                    lambda: {(("rule", k),): v[1] for k, v in moderation_pipeline.stats.items()})
+    metrics.collect("bot_moderation_rule_seconds_total", "counter", "Time spent in each moderation rule.",
+                    lambda: {(("rule", k),): v[2] / 1e9 for k, v in moderation_pipeline.stats.items()})
+    metrics.collect("bot_flood_flagged_total", "counter", "Messages flagged as flood.",
+                    lambda: {(): flood_tracker.flagged})
+    metrics.collect("bot_spam_flagged_total", "counter", "Messages flagged as near-duplicate spam.",
+                    lambda: {(): spam_fingerprints.flagged})
+    metrics.collect("bot_pending_deletes", "gauge", "Temporary messages waiting to be deleted.",
+                    lambda: {(): deletion_scheduler.pending})
+    metrics.collect("bot_welcome_joins_total", "counter", "New members seen by the welcome batcher.",
+                    lambda: {(): welcome_batcher.joins})
+    metrics.collect("bot_welcome_sent_total", "counter", "Batched welcome messages sent.",
+                    lambda: {(): welcome_batcher.sent})
+    metrics.collect("bot_startup_seconds", "gauge", "Cold start time by phase.",
+                    lambda: {(("phase", k),): v / 1000 for k, v in startup.phases.items()})
+    metrics.collect("bot_startup_budget_seconds", "gauge", "Cold start budget up to the first update.",
+                    lambda: {(): startup.budget_ms / 1000})
+    metrics.collect("bot_active_games", "gauge", "Chats with a dice game in memory.",
+                    lambda: {(): len(games)})
+
+# ===== MAIN FUNCTION =====
+def build_application(token: str, request: BaseRequest = None) -> Application:
+    app = (
+        Application.builder()
+        .token(token)
+        .request(InstrumentedRequest(request or HTTPXRequest(connection_pool_size=256)))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .concurrent_updates(
+            PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES)
+        )
+        .build()
+    )
 
     # ===== COMMANDS =====
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("report", report_user))
+    app.add_handler(CommandHandler("modstats", modstats))
 
     # ===== GAME COMMANDS =====
     app.add_handler(CommandHandler("roll", roll))
@@ -528,11 +2308,22 @@ def main():
     app.add_handler(CommandHandler("switchkuri", switch_kuri))
     app.add_handler(CommandHandler("switchkaze", switch_kaze))
 
+    # ===== MEMBER STATUS TRACKING =====
+    app.add_handler(
+        ChatMemberHandler(track_member, ChatMemberHandler.ANY_CHAT_MEMBER)
+    )
+
     # ===== WELCOME =====
     app.add_handler(
         MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, welcome)
     )
 
+    # ===== 🌊 FLOOD CONTROL (before everything else) =====
+    app.add_handler(
+        MessageHandler(filters.ChatType.GROUPS & ~filters.StatusUpdate.ALL, flood_control),
+        group=-1
+    )
+
     # ===== 🚨 MODERATION FIRST =====
     app.add_handler(
         MessageHandler(
@@ -548,9 +2339,30 @@ def main():
         group=1
     )
 
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    instrument(app)
+    return app
+
+
+def main():
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise RuntimeError("Missing TELEGRAM_TOKEN env var.")
+
+    if WEBHOOK_URL and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET):
+        raise RuntimeError("WEBHOOK_SECRET must be set (1-256 of A-Z, a-z, 0-9, _ and -) in webhook mode.")
+
+    app = build_application(token)
+    startup.mark("build")
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(app))
+    else:
+        if HEALTH_SERVER:
+            keep_alive()
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
+
 
+# Everything above runs at import: regexes, responder and moderation tables.
+startup.mark("tables")
 
 if __name__ == "__main__":
-    keep_alive()
     main()
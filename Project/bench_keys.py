@@ -0,0 +1,515 @@
+"""Benchmarks for the key server in main.py.
+
+Run from this directory with:  python bench_keys.py [section ...]
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+from telegram.request import BaseRequest
+
+import main
+
+# =========================
+# HELPERS
+# =========================
+def make_keys(n):
+    expires = (datetime.utcnow() + timedelta(days=30)).isoformat()
+    return {f"{main.KEY_PREFIX}-{i:012d}": {"expires": expires, "active": True} for i in range(n)}
+
+def write_key_db(keys):
+    path = os.path.join(tempfile.mkdtemp(prefix="keys-bench-"), "keys.json")
+    with open(path, "w") as f:
+        json.dump(keys, f, indent=4)
+    return path
+
+def per_call_us(fn, keys, seconds=0.5):
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        for key in keys:
+            fn(key)
+        calls += len(keys)
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return elapsed / calls * 1e6
+
+# =========================
+# CHECK LOOKUP
+# =========================
+def check_reloading(path, key):
+    # What /check did before the key store: parse the whole file per request.
+    with open(path, "r") as f:
+        data = json.load(f)
+    info = data.get(key)
+    if info is None:
+        return {"status": "invalid"}
+    if not info["active"]:
+        return {"status": "revoked"}
+    if datetime.utcnow() > datetime.fromisoformat(info["expires"]):
+        return {"status": "expired"}
+    return {"status": "valid", "expires": info["expires"]}
+
+def bench_check(sizes=(1_000, 10_000, 100_000, 200_000)):
+    for n in sizes:
+        keys = make_keys(n)
+        path = write_key_db(keys)
+        probe = list(keys)[:: max(1, n // 100)] + ["MOD-NOTAKEY0000"]
+
+        main.key_store = main.KeyStore(path)
+        main.key_store.refresh(force=True)
+        store_us = per_call_us(main.validate_key, probe)
+        reload_us = per_call_us(lambda k: check_reloading(path, k), probe[:3], seconds=0.3)
+        print(f"check       {n:>8,} keys  store {store_us:7.2f} us/check   "
+              f"reload-per-request {reload_us / 1000:9.2f} ms/check")
+
+# =========================
+# WRITES
+# =========================
+def bench_writes(sizes=(1_000, 100_000, 300_000), writes=200):
+    info = {"expires": (datetime.utcnow() + timedelta(days=30)).isoformat(), "active": True}
+    for n in sizes:
+        keys = make_keys(n)
+        path = write_key_db(keys)
+        store = main.KeyStore(path, compact_every=10**9)
+        store.refresh(force=True)
+
+        started = time.perf_counter()
+        for i in range(writes):
+            store.add(f"{main.KEY_PREFIX}-NEW{i:09d}", info)
+        append_ms = (time.perf_counter() - started) / writes * 1000
+
+        started = time.perf_counter()
+        store.compact()
+        compact_ms = (time.perf_counter() - started) * 1000
+        store.close()
+
+        # What every /genkey and /revoke used to do.
+        rewrites = max(1, min(writes, 2_000_000 // n))
+        started = time.perf_counter()
+        for _ in range(rewrites):
+            with open(path, "r") as f:
+                data = json.load(f)
+            data["MOD-REWRITE"] = info
+            with open(path, "w") as f:
+                json.dump(data, f, indent=4)
+        rewrite_ms = (time.perf_counter() - started) / rewrites * 1000
+        print(f"writes      {n:>8,} keys  journal append+fsync {append_ms:6.2f} ms/write   "
+              f"load+rewrite {rewrite_ms:8.2f} ms/write   compaction {compact_ms:7.1f} ms")
+
+# =========================
+# EXPIRY
+# =========================
+def bench_expiry(n=200_000, expiring=20_000):
+    now = int(time.time())
+    keys = {}
+    for i in range(n):
+        expires_at = now + (1 + i % 1000 if i < expiring else 86_400 * 30)
+        keys[f"{main.KEY_PREFIX}-{i:012d}"] = {
+            "expires": datetime.utcfromtimestamp(expires_at).isoformat(),
+            "expires_at": expires_at,
+            "active": True,
+        }
+    store = main.KeyStore(write_key_db(keys))
+    started = time.perf_counter()
+    store.refresh(force=True)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    marked = store.sweep(now + 2_000)
+    sweep_ms = (time.perf_counter() - started) * 1000
+    stats_us = per_call_us(lambda _: store.stats(), [None])
+
+    info = next(iter(keys.values()))
+    iso_us = per_call_us(lambda _: datetime.utcnow() > datetime.fromisoformat(info["expires"]), [None])
+    int_us = per_call_us(lambda _: now >= info["expires_at"], [None])
+    print(f"expiry      {n:,} keys: load+index {load_ms:.0f} ms, sweep {marked:,} expired in "
+          f"{sweep_ms:.1f} ms ({sweep_ms * 1000 / marked:.2f} us/key), stats {stats_us:.2f} us")
+    print(f"            expiry test per check: iso parse {iso_us:.3f} us  vs  int compare {int_us:.3f} us")
+
+# =========================
+# HTTP LOAD
+# =========================
+# A bare app with only the check routes: main.api's startup hook needs a bot token.
+# Built by a factory so uvicorn can import it in every worker process.
+def check_app():
+    from fastapi import FastAPI
+
+    path = os.environ["BENCH_KEY_DB"]
+    if os.environ.get("KEY_BACKEND") == "sqlite":
+        main.key_store = main.SqliteKeyStore(path + ".db", import_from=path)
+    else:
+        main.key_store = main.KeyStore(path)
+    app = FastAPI()
+    # Loads the index and starts the background reloader, as main.api does.
+    app.on_event("startup")(main.start_key_store)
+    app.add_middleware(main.CheckRateLimitMiddleware)
+    if os.environ["BENCH_MODE"] == "threadpool":
+        def check_key(key: str):
+            return main.validate_key(key)
+        app.add_api_route("/check", check_key)
+    else:
+        app.add_api_route("/check", main.check_key)
+        app.add_api_route("/check/batch", main.check_batch, methods=["POST"])
+    return app
+
+SERVER = """
+import sys, uvicorn
+uvicorn.run("bench_keys:check_app", factory=True, host="127.0.0.1", port=int(sys.argv[1]),
+            log_level="warning")
+"""
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(path, mode, **env):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-c", SERVER, str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, BENCH_KEY_DB=path, BENCH_MODE=mode, **env),
+    )
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc, port
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+async def http_call(reader, writer, request):
+    writer.write(request)
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    await reader.readexactly(length)
+    return status
+
+async def hammer(port, make_request, requests, concurrency):
+    """``port`` may be a list; connections are spread over it round-robin."""
+    ports = port if isinstance(port, list) else [port]
+    # A bare keep-alive client: on a small box httpx would cost more CPU than
+    # the server we are trying to measure.
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def worker(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            for i in remaining:
+                started = time.perf_counter()
+                status = await http_call(reader, writer, make_request(i))
+                if status != 200:
+                    raise RuntimeError(f"HTTP {status}")
+                latencies.append(time.perf_counter() - started)
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(ports[i % len(ports)]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return requests / elapsed, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+def bench_http(n=100_000, requests=5_000, concurrency=16, batch=100):
+    keys = list(make_keys(n))
+    path = write_key_db(dict.fromkeys(keys, {"expires": "2099-01-01T00:00:00", "active": True}))
+
+    def single(i):
+        return (f"GET /check?key={keys[i * 7919 % n]} HTTP/1.1\r\n"
+                "Host: bench\r\n\r\n").encode()
+
+    def batched(i):
+        body = json.dumps({"keys": [keys[(i * batch + j) % n] for j in range(batch)]}).encode()
+        return (b"POST /check/batch HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+
+    for mode, label, make_request, per_request in (
+        ("threadpool", "GET /check (sync def)", single, 1),
+        ("async", "GET /check (async)", single, 1),
+        ("async", f"POST /check/batch x{batch}", batched, batch),
+    ):
+        proc, port = start_server(path, mode, CHECK_RATE_PER_SEC="0")
+        try:
+            rps, p50, p99 = asyncio.run(hammer(port, make_request, requests, concurrency))
+        finally:
+            proc.terminate()
+            proc.wait()
+        print(f"http        {label:26} {rps:8,.0f} req/s  {rps * per_request:9,.0f} keys/s  "
+              f"p50 {p50:6.2f} ms  p99 {p99:6.2f} ms  ({concurrency} connections)")
+
+
+# =========================
+# GUESS FLOOD
+# =========================
+def check_request(key, client):
+    # uvicorn trusts X-Forwarded-For from 127.0.0.1 by default, as it would from
+    # a proxy listed in --forwarded-allow-ips.
+    return (f"GET /check?key={key} HTTP/1.1\r\nHost: bench\r\n"
+            f"X-Forwarded-For: {client}\r\n\r\n").encode()
+
+async def flood_run(port, keys, attackers, seconds, rate):
+    # One client checks real keys at `rate` req/s while `attackers` connections
+    # from another IP send random guesses as fast as they can.
+    stop = asyncio.Event()
+    attack = {200: 0, 429: 0}
+    latencies = []
+
+    async def attacker():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while not stop.is_set():
+                status = await http_call(reader, writer, check_request(main.generate_key(), "203.0.113.9"))
+                attack[status] = attack.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    async def client():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        # Warm up the connection before timing.
+        await http_call(reader, writer, check_request(keys[0], "198.51.100.7"))
+        try:
+            for i in range(int(seconds * rate)):
+                started = time.perf_counter()
+                status = await http_call(reader, writer, check_request(keys[i % len(keys)], "198.51.100.7"))
+                if status != 200:
+                    raise RuntimeError(f"valid client got HTTP {status}")
+                latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(max(0, 1 / rate - (time.perf_counter() - started)))
+        finally:
+            stop.set()
+            writer.close()
+
+    await asyncio.gather(client(), *(attacker() for _ in range(attackers)))
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000, attack
+
+def bench_flood(n=100_000, attackers=32, seconds=5, rate=15):
+    keys = list(make_keys(n))
+    path = write_key_db(dict.fromkeys(keys, {"expires": "2099-01-01T00:00:00", "active": True}))
+    random.shuffle(keys)
+
+    for label, limit, flood in (
+        ("no flood", "20", 0),
+        ("flood, no limiter", "0", attackers),
+        ("flood, limiter", "20", attackers),
+    ):
+        proc, port = start_server(path, "async", CHECK_RATE_PER_SEC=limit)
+        try:
+            p50, p99, attack = asyncio.run(flood_run(port, keys, flood, seconds, rate))
+        finally:
+            proc.terminate()
+            proc.wait()
+        guesses = sum(attack.values())
+        print(f"flood       {label:18} valid client p50 {p50:6.2f} ms  p99 {p99:7.2f} ms  "
+              f"guesses {guesses / seconds:7,.0f}/s ({attack.get(429, 0):,} got 429)")
+
+
+# =========================
+# WEBHOOK INGEST
+# =========================
+class FakeBotAPI(BaseRequest):
+    """In-process Bot API that answers every call after ``latency`` seconds."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "KeyBot", "username": "keybot"}
+        elif endpoint == "sendMessage":
+            params = request_data.parameters
+            result = {
+                "message_id": self.calls, "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+def admin_update(update_id, admin_id):
+    user = {"id": admin_id, "is_bot": False, "first_name": "Admin"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()),
+            "chat": {"id": admin_id, "type": "private"}, "from": user,
+            "text": "/listkeys",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 9}],
+        },
+    }
+
+async def webhook_run(updates, redeliveries, latency):
+    import httpx
+
+    main.ADMIN_ID = 42
+    main.key_store = main.KeyStore(write_key_db(make_keys(10)))
+    main.application = main.build_application(ApplicationBuilder().token("123:BENCH").request(FakeBotAPI(latency)))
+    await main.application.initialize()
+    main.update_queue = main.UpdateQueue(main.WEBHOOK_QUEUE_SIZE, main.WEBHOOK_WORKERS, main.WEBHOOK_DEDUPE_SIZE)
+    main.update_queue.start()
+    payloads = [admin_update(i, main.ADMIN_ID) for i in range(updates)]
+
+    # Old path: the handler ran before the response was sent.
+    inline = []
+    for payload in payloads[:20]:
+        started = time.perf_counter()
+        await main.application.process_update(Update.de_json(payload, main.application.bot))
+        inline.append(time.perf_counter() - started)
+
+    acks = []
+    transport = httpx.ASGITransport(app=main.api)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        for payload in payloads + payloads[:redeliveries]:
+            sent = time.perf_counter()
+            response = await client.post(main.WEBHOOK_PATH, json=payload)
+            response.raise_for_status()
+            acks.append(time.perf_counter() - sent)
+        await main.update_queue.stop()
+        drained = time.perf_counter() - started
+    await main.application.shutdown()
+    inline.sort()
+    acks.sort()
+    return inline[len(inline) // 2], acks[len(acks) // 2], acks[int(len(acks) * 0.99)], drained, main.update_queue.stats()
+
+def bench_webhook(updates=500, redeliveries=100, latency=0.05):
+    inline, ack_p50, ack_p99, drained, stats = asyncio.run(webhook_run(updates, redeliveries, latency))
+    print(f"webhook     inline handler before ack {inline * 1000:6.1f} ms   queued ack p50 {ack_p50 * 1000:5.2f} ms  "
+          f"p99 {ack_p99 * 1000:5.2f} ms  (Bot API latency {latency * 1000:.0f} ms)")
+    print(f"            {updates} updates + {redeliveries} redeliveries drained in {drained:.2f} s by "
+          f"{main.WEBHOOK_WORKERS} workers: {stats['processed']} processed, {stats['duplicates']} duplicates "
+          f"dropped, lag avg {stats['lag_avg_ms']:.0f} ms max {stats['lag_max_ms']:.0f} ms")
+
+
+# =========================
+# SIGNED KEYS
+# =========================
+def bench_signed(n=100_000, revoked=1_000):
+    main.KEY_SECRET = b"bench-secret"
+    expires_at = int(time.time()) + 86_400 * 30
+    keys = make_keys(n)
+    signed = []
+    for i in range(n):
+        key, kid = main.generate_signed_key(expires_at)
+        signed.append(key)
+        keys[key] = {"expires": main.iso_utc(expires_at), "expires_at": expires_at,
+                     "kid": kid, "active": i >= revoked}
+    main.key_store = main.KeyStore(write_key_db(keys))
+    main.key_store.refresh(force=True)
+
+    stored = list(keys)[:n:max(1, n // 1000)]
+    signed_probe = signed[revoked::max(1, n // 1000)]
+    stored_us = per_call_us(main.validate_key, stored)
+    signed_us = per_call_us(main.validate_key, signed_probe)
+    verify_us = per_call_us(main.verify_signed_key, signed_probe)
+    print(f"signed      {n:,} stored + {n:,} signed keys ({revoked:,} revoked): "
+          f"stored {1e6 / stored_us:9,.0f} checks/s   signed {1e6 / signed_us:9,.0f} checks/s "
+          f"(HMAC verify alone {verify_us:.2f} us)")
+    print(f"            revocation set: {revoked:,} key ids; signed checks never read the key index")
+
+
+# =========================
+# WORKERS
+# =========================
+async def fresh_check(port, key):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(f"GET /check?key={key} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode())
+        return json.loads((await reader.read()).split(b"\r\n\r\n", 1)[1])["status"]
+    finally:
+        writer.close()
+
+async def revocation_delay(ports, path, key):
+    # Revoke from a separate connection, like /revoke in another worker would.
+    writer = main.SqliteKeyStore(path + ".db", import_from=None)
+    writer.refresh(force=True)
+    revoked_at = time.perf_counter()
+    writer.revoke(key)
+    writer.close()
+    pending = set(ports)
+    while pending:
+        for port in list(pending):
+            if await fresh_check(port, key) == "revoked":
+                pending.discard(port)
+        await asyncio.sleep(0.005)
+    return time.perf_counter() - revoked_at
+
+def bench_workers(n=100_000, requests=5_000, concurrency=16, counts=(1, 2, 4)):
+    # Each worker is its own uvicorn process on its own port, and the client spreads
+    # connections over them; the processes share nothing but the key database.
+    keys = list(make_keys(n))
+
+    def single(i):
+        return (f"GET /check?key={keys[i * 7919 % n]} HTTP/1.1\r\n"
+                "Host: bench\r\n\r\n").encode()
+
+    runs = [("json", 1)] + [("sqlite", workers) for workers in counts]
+    for backend, workers in runs:
+        path = write_key_db(dict.fromkeys(keys, {"expires": "2099-01-01T00:00:00", "active": True}))
+        if backend == "sqlite":
+            # Import once up front instead of racing the workers into it.
+            main.SqliteKeyStore(path + ".db", import_from=path).refresh()
+        servers = [
+            start_server(path, "async", CHECK_RATE_PER_SEC="0", KEY_BACKEND=backend)
+            for _ in range(workers)
+        ]
+        ports = [port for _, port in servers]
+        try:
+            # Warm up every worker before timing.
+            asyncio.run(hammer(ports, single, workers * 50, workers))
+            rps, p50, p99 = asyncio.run(hammer(ports, single, requests, concurrency))
+            visible = ""
+            if backend == "sqlite":
+                delay = asyncio.run(revocation_delay(ports, path, keys[1]))
+                visible = f"  revoke visible in every worker after {delay * 1000:4.0f} ms"
+        finally:
+            for proc, _ in servers:
+                proc.terminate()
+                proc.wait()
+        print(f"workers     {backend:6} x{workers}  {rps:8,.0f} req/s  p50 {p50:6.2f} ms  "
+              f"p99 {p99:6.2f} ms{visible}")
+    print(f"            ({os.cpu_count()} CPU; reload interval {main.KEY_RELOAD_INTERVAL:.0f} s)")
+
+
+SECTIONS = {
+    "check": bench_check,
+    "writes": bench_writes,
+    "expiry": bench_expiry,
+    "http": bench_http,
+    "flood": bench_flood,
+    "webhook": bench_webhook,
+    "signed": bench_signed,
+    "workers": bench_workers,
+}
+
+if __name__ == "__main__":
+    for section in sys.argv[1:] or SECTIONS:
+        SECTIONS[section]()
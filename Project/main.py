@@ -1,10 +1,21 @@
 import os
+import re
 import json
+import hmac
+import math
+import time
+import secrets
+import heapq
+import asyncio
 import random
 import string
-from datetime import datetime, timedelta
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Header, HTTPException, Request
+from pydantic import BaseModel
 from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
@@ -19,7 +30,38 @@ BOT_TOKEN = os.environ.get("BOT_TOKEN")
 ADMIN_ID = int(os.environ.get("ADMIN_ID", "0"))
 
 KEY_PREFIX = "MOD"
+# With a secret set, /genkey issues signed keys that /check verifies without a
+# store lookup. Rotating it invalidates every signed key.
+KEY_SECRET = os.environ.get("KEY_SECRET", "").encode()
 KEY_DB = "keys.json"
+KEY_RELOAD_INTERVAL = float(os.environ.get("KEY_RELOAD_INTERVAL", "1"))
+KEY_COMPACT_EVERY = int(os.environ.get("KEY_COMPACT_EVERY", "1000"))
+# "sqlite" shares one database between uvicorn workers; "json" is single-process.
+KEY_BACKEND = os.environ.get("KEY_BACKEND", "json")
+KEY_SQLITE = os.environ.get("KEY_SQLITE", "keys.db")
+CHECK_BATCH_MAX = int(os.environ.get("CHECK_BATCH_MAX", "100"))
+KEY_SWEEP_INTERVAL = float(os.environ.get("KEY_SWEEP_INTERVAL", "60"))
+# /listkeys stops listing keys near Telegram's 4096-character message limit,
+# keeping LIST_KEYS_RESERVE free for the remaining titles and "… and N more" lines.
+LIST_KEYS_MAX_CHARS = 4000
+LIST_KEYS_RESERVE = 200
+# GET /stats answers only requests with "Authorization: Bearer <STATS_TOKEN>";
+# without a token set it is disabled.
+STATS_TOKEN = os.environ.get("STATS_TOKEN", "")
+
+# Per-client limit on /check, in keys per second (0, the default, disables it).
+# Clients are told apart by scope["client"], so behind a proxy (the default
+# Render deployment) uvicorn must rewrite it from X-Forwarded-For:
+#   uvicorn main:api --proxy-headers --forwarded-allow-ips=<proxy addresses>
+# Without that every client shares the proxy's bucket and a flood locks out
+# everyone. Don't use --forwarded-allow-ips="*": clients could then pick their IP.
+CHECK_RATE_PER_SEC = float(os.environ.get("CHECK_RATE_PER_SEC", "0"))
+CHECK_RATE_BURST = float(os.environ.get("CHECK_RATE_BURST", "200"))
+CHECK_RATE_MAX_CLIENTS = 100_000
+
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "4"))
+WEBHOOK_DEDUPE_SIZE = 4096
 
 WEBHOOK_PATH = f"/webhook/{BOT_TOKEN}"
 WEBHOOK_URL = f"https://kazebot-kybb.onrender.com{WEBHOOK_PATH}"
@@ -29,24 +71,462 @@ WEBHOOK_URL = f"https://kazebot-kybb.onrender.com{WEBHOOK_PATH}"
 # =========================
 api = FastAPI()
 application = None
+sweeper = None
 
 # =========================
 # UTILS
 # =========================
-def load_keys():
-    if not os.path.exists(KEY_DB):
-        return {}
-    with open(KEY_DB, "r") as f:
-        return json.load(f)
-
-def save_keys(data):
-    with open(KEY_DB, "w") as f:
-        json.dump(data, f, indent=4)
-
 def generate_key():
     rand = "".join(random.choices(string.ascii_uppercase + string.digits, k=12))
     return f"{KEY_PREFIX}-{rand}"
 
+# Signed key: KEY_PREFIX-HEX(key id (6 bytes) | expires_at (4 bytes) | HMAC-SHA256[:10])
+SIGNED_KEY_BODY = 10
+SIGNED_KEY_BYTES = 20
+SIGNED_KEY_LENGTH = len(KEY_PREFIX) + 1 + SIGNED_KEY_BYTES * 2
+SIGNED_KEY_RE = re.compile(f"{KEY_PREFIX}-([0-9A-F]{{{SIGNED_KEY_BYTES * 2}}})")
+SIGNED_KEY_MAX_EXPIRY = (1 << 32) - 1
+
+def generate_signed_key(expires_at, kid=None):
+    kid = secrets.randbits(48) if kid is None else kid
+    body = kid.to_bytes(6, "big") + expires_at.to_bytes(4, "big")
+    mac = hmac.digest(KEY_SECRET, body, "sha256")[:SIGNED_KEY_BYTES - SIGNED_KEY_BODY]
+    return f"{KEY_PREFIX}-{(body + mac).hex().upper()}", kid
+
+def verify_signed_key(key):
+    """Returns (key id, expires_at) for an authentic signed key, else None."""
+    if not KEY_SECRET or len(key) != SIGNED_KEY_LENGTH:
+        return None
+    # fullmatch, not bytes.fromhex alone: fromhex skips whitespace, which would
+    # let a padded key carry a short (or empty) MAC.
+    match = SIGNED_KEY_RE.fullmatch(key)
+    if match is None:
+        return None
+    raw = bytes.fromhex(match.group(1))
+    if len(raw) != SIGNED_KEY_BYTES:
+        return None
+    body, mac = raw[:SIGNED_KEY_BODY], raw[SIGNED_KEY_BODY:]
+    expected = hmac.digest(KEY_SECRET, body, "sha256")[:SIGNED_KEY_BYTES - SIGNED_KEY_BODY]
+    if not hmac.compare_digest(mac, expected):
+        return None
+    return int.from_bytes(body[:6], "big"), int.from_bytes(body[6:], "big")
+
+def iso_utc(epoch):
+    return datetime.utcfromtimestamp(epoch).isoformat()
+
+def expiry_epoch(expires):
+    # Stored ISO timestamps are naive UTC.
+    dt = datetime.fromisoformat(expires)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+def fsync_dir(path):
+    # Makes a rename durable; not every platform lets you open a directory.
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# =========================
+# KEY STORE
+# =========================
+class KeyStore:
+    """In-memory index of the key database, persisted as a snapshot plus a journal.
+
+    KEY_DB holds a snapshot of every key. Each /genkey or /revoke appends one
+    ``[key, info]`` line to ``KEY_DB + ".log"`` and fsyncs it, so a write costs
+    one small append no matter how many keys exist. Loading folds the journal
+    over the snapshot; a torn last line from a crash is ignored. Once
+    ``compact_every`` entries have piled up, a background thread writes a new
+    snapshot atomically (temp file, fsync, rename) and drops the old journal.
+
+    Lookups are served from a dict and never touch the disk. ``refresh()``
+    compares the snapshot and journal stamps (mtime, size) with what was
+    loaded and rebuilds the index only if they changed; the server calls it
+    every ``reload_interval`` seconds from a thread (see maintain_key_store),
+    so a reload never blocks the event loop. ``generation`` goes up on every
+    load or write.
+
+    Signed keys are stored too, for listings and stats, with their key id as
+    ``kid``; /check only asks ``is_revoked_id()`` about them.
+
+    Every entry carries ``expires_at`` as epoch seconds (filled in on load for
+    older entries), and active keys sit in a min-heap by expiry. ``sweep()``
+    pops whatever has expired and marks it, at O(log n) per key, so the
+    active/expired/revoked counts are always known without a scan.
+    """
+
+    def __init__(self, path, reload_interval=KEY_RELOAD_INTERVAL, compact_every=KEY_COMPACT_EVERY):
+        self.path = path
+        self.log_path = path + ".log"
+        # Journal being folded into a new snapshot; replayed too if we crash mid-way.
+        self.compacting_path = path + ".log.compacting"
+        self.reload_interval = reload_interval
+        self.compact_every = compact_every
+        self.generation = 0
+        self.compactions = 0
+        self._keys = {}
+        self._expiry_heap = []  # [(expires_at, key)] for keys that were active when pushed
+        self._expired = set()
+        self._counts = {"active": 0, "expired": 0, "revoked": 0}
+        self._revoked_ids = set()
+        self.swept = 0
+        self._stamp = None
+        self._checked = None
+        self._log = None
+        self._log_entries = 0
+        self._compactor = None
+        self._lock = threading.RLock()
+
+    def _file_stamp(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _stamps(self):
+        return (
+            self._file_stamp(self.path),
+            self._file_stamp(self.compacting_path),
+            self._file_stamp(self.log_path),
+        )
+
+    def _replay(self, path, keys):
+        try:
+            f = open(path, "rb+")
+        except FileNotFoundError:
+            return 0
+        entries = 0
+        good = 0
+        with f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated entry")
+                    key, info = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash: cut it off so later appends
+                    # don't end up glued to it.
+                    f.truncate(good)
+                    break
+                keys[key] = info
+                entries += 1
+                good += len(line)
+        return entries
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._checked is not None and now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            self._checked = now
+            # Stat before reading: a write that lands in between changes the
+            # stamp again, so the next refresh picks it up.
+            stamp = self._stamps()
+            if stamp == self._stamp:
+                return
+            keys = {}
+            if stamp[0] is not None:
+                with open(self.path, "r") as f:
+                    keys = json.load(f)
+            self._replay(self.compacting_path, keys)
+            self._log_entries = self._replay(self.log_path, keys)
+            for info in keys.values():
+                if "expires_at" not in info:
+                    info["expires_at"] = expiry_epoch(info["expires"])
+            self._index(keys, int(time.time()))
+            self._stamp = stamp
+            self.generation += 1
+
+    def _index(self, keys, now):
+        # Built aside and published whole: readers on the event loop don't
+        # take the lock, so they must never see a half-built index.
+        heap, expired, revoked_ids = [], set(), set()
+        counts = dict.fromkeys(self._counts, 0)
+        for key, info in keys.items():
+            if not info["active"]:
+                counts["revoked"] += 1
+                if "kid" in info:
+                    revoked_ids.add(info["kid"])
+            elif info["expires_at"] <= now:
+                expired.add(key)
+                counts["expired"] += 1
+            else:
+                counts["active"] += 1
+                heap.append((info["expires_at"], key))
+        heapq.heapify(heap)
+        self._expiry_heap, self._expired, self._revoked_ids = heap, expired, revoked_ids
+        self._counts = counts
+        self._keys = keys
+
+    def _track(self, key, info, now):
+        if not info["active"]:
+            self._counts["revoked"] += 1
+            if "kid" in info:
+                self._revoked_ids.add(info["kid"])
+        elif info["expires_at"] <= now:
+            self._expired.add(key)
+            self._counts["expired"] += 1
+        else:
+            self._counts["active"] += 1
+            heapq.heappush(self._expiry_heap, (info["expires_at"], key))
+
+    def state(self, key, info):
+        if not info["active"]:
+            return "revoked"
+        return "expired" if key in self._expired else "active"
+
+    def sweep(self, now=None):
+        """Mark keys whose expiry has passed; returns how many were marked."""
+        now = int(time.time()) if now is None else now
+        marked = 0
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                expires_at, key = heapq.heappop(heap)
+                info = self._keys.get(key)
+                # Skip entries left behind by a revoke or a re-issued key.
+                if (info is None or not info["active"] or info["expires_at"] != expires_at
+                        or key in self._expired):
+                    continue
+                self._expired.add(key)
+                self._counts["active"] -= 1
+                self._counts["expired"] += 1
+                marked += 1
+            self.swept += marked
+        return marked
+
+    def stats(self):
+        return dict(self._counts, total=len(self._keys))
+
+    def get(self, key):
+        return self._keys.get(key)
+
+    def is_revoked_id(self, kid):
+        return kid in self._revoked_ids
+
+    def all(self):
+        return self._keys
+
+    def _append(self, key, info):
+        if self._log is None:
+            self._log = open(self.log_path, "a")
+        self._log.write(json.dumps([key, info]) + "\n")
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._apply(key, info)
+        self._log_entries += 1
+        self._stamp = self._stamps()
+        self.generation += 1
+        if self._log_entries >= self.compact_every:
+            self.compact(background=True)
+
+    def _apply(self, key, info):
+        # Values are replaced, never mutated, so a compaction copy stays consistent.
+        old = self._keys.get(key)
+        if old is not None:
+            self._counts[self.state(key, old)] -= 1
+            self._expired.discard(key)
+            if not old["active"] and "kid" in old:
+                self._revoked_ids.discard(old["kid"])
+        self._keys[key] = info
+        self._track(key, info, int(time.time()))
+
+    def add(self, key, info):
+        if "expires_at" not in info:
+            info = {**info, "expires_at": expiry_epoch(info["expires"])}
+        self.refresh(force=True)
+        with self._lock:
+            self._append(key, info)
+
+    def revoke(self, key):
+        self.refresh(force=True)
+        with self._lock:
+            info = self._keys.get(key)
+            if info is None:
+                return False
+            self._append(key, {**info, "active": False})
+            return True
+
+    def compact(self, background=False):
+        """Fold the journal into a fresh KEY_DB snapshot."""
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            if os.path.exists(self.compacting_path):
+                # A previous compaction died; its entries are already folded in.
+                self._write_snapshot(dict(self._keys))
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            if not os.path.exists(self.log_path):
+                return
+            os.replace(self.log_path, self.compacting_path)
+            self._log_entries = 0
+            self._stamp = self._stamps()
+            keys = dict(self._keys)
+        if background:
+            self._compactor = threading.Thread(
+                target=self._write_snapshot, args=(keys,), name="key-compactor", daemon=True
+            )
+            self._compactor.start()
+        else:
+            self._write_snapshot(keys)
+
+    def _write_snapshot(self, keys):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(keys, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        fsync_dir(self.path)
+        try:
+            os.remove(self.compacting_path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._stamp = self._stamps()
+            self.compactions += 1
+
+    def close(self):
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+class SqliteKeyStore(KeyStore):
+    """KeyStore backed by SQLite in WAL mode, shared by several worker processes.
+
+    Each process keeps the same in-memory index as KeyStore and writes through
+    to a ``keys`` table indexed by key. Every write gets the next ``seq``.
+    Every ``reload_interval`` seconds a process reads ``PRAGMA data_version``,
+    which changes when another connection commits, and applies only rows newer
+    than the last ``seq`` it has seen. A revoke in one worker therefore reaches
+    the others within ``reload_interval``.
+
+    An empty database imports ``import_from`` (KEY_DB and its journal) once.
+    """
+
+    def __init__(self, path, reload_interval=KEY_RELOAD_INTERVAL, import_from=KEY_DB):
+        super().__init__(path, reload_interval)
+        self.import_from = import_from
+        self._db = None
+        self._data_version = None
+        self._seq = 0
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=FULL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS keys ("
+            " key TEXT PRIMARY KEY,"
+            " expires TEXT NOT NULL,"
+            " expires_at INTEGER NOT NULL,"
+            " kid INTEGER,"
+            " active INTEGER NOT NULL,"
+            " seq INTEGER NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS keys_seq ON keys (seq)")
+        if self.import_from and os.path.exists(self.import_from):
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                # Checked inside the write lock so only one worker imports.
+                if db.execute("SELECT 1 FROM keys LIMIT 1").fetchone() is None:
+                    legacy = KeyStore(self.import_from)
+                    legacy.refresh(force=True)
+                    db.executemany(
+                        "INSERT INTO keys VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            (key, info["expires"], info["expires_at"], info.get("kid"),
+                             int(info["active"]), seq)
+                            for seq, (key, info) in enumerate(legacy.all().items(), 1)
+                        ),
+                    )
+                    legacy.close()
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return db
+
+    @staticmethod
+    def _row_info(row):
+        info = {"expires": row[1], "expires_at": row[2], "active": bool(row[4])}
+        if row[3] is not None:
+            info["kid"] = row[3]
+        return info
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._checked is not None and now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            self._checked = now
+            if self._db is None:
+                self._db = self._connect()
+            version = self._db.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._data_version:
+                return
+            self._data_version = version
+            rows = self._db.execute(
+                "SELECT key, expires, expires_at, kid, active, seq FROM keys"
+                " WHERE seq > ? ORDER BY seq",
+                (self._seq,),
+            ).fetchall()
+            if not rows:
+                return
+            if self._seq == 0:
+                self._index({row[0]: self._row_info(row) for row in rows}, int(time.time()))
+            else:
+                # Rows we wrote ourselves come back too; applying them again is harmless.
+                for row in rows:
+                    self._apply(row[0], self._row_info(row))
+            self._seq = rows[-1][5]
+            self.generation += 1
+
+    def _append(self, key, info):
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "INSERT INTO keys (key, expires, expires_at, kid, active, seq)"
+                " VALUES (?, ?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM keys))"
+                " ON CONFLICT (key) DO UPDATE SET expires = excluded.expires,"
+                " expires_at = excluded.expires_at, kid = excluded.kid,"
+                " active = excluded.active, seq = excluded.seq",
+                (key, info["expires"], info["expires_at"], info.get("kid"), int(info["active"])),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self._apply(key, info)
+        self.generation += 1
+
+    def compact(self, background=False):
+        """Nothing to fold: SQLite checkpoints its own WAL."""
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+if KEY_BACKEND == "sqlite":
+    key_store = SqliteKeyStore(KEY_SQLITE)
+else:
+    key_store = KeyStore(KEY_DB)
+
 # =========================
 # TELEGRAM COMMANDS
 # =========================
@@ -68,16 +548,35 @@ async def genkey(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /genkey <days>")
         return
 
-    days = int(context.args[0])
-    key = generate_key()
-    expires = (datetime.utcnow() + timedelta(days=days)).isoformat()
+    # Signed keys store the expiry in 4 bytes, so they can't outlive 2106.
+    max_expiry = SIGNED_KEY_MAX_EXPIRY if KEY_SECRET else expiry_epoch("9999-12-31T00:00:00")
+    try:
+        days = int(context.args[0])
+        expires_at = int(time.time()) + days * 86400
+    except ValueError:
+        days = expires_at = 0
+    if days < 1 or expires_at > max_expiry:
+        max_days = (max_expiry - int(time.time())) // 86400
+        await update.message.reply_text(f"Usage: /genkey <days>  (1 to {max_days})")
+        return
 
-    data = load_keys()
-    data[key] = {
-        "expires": expires,
-        "active": True
-    }
-    save_keys(data)
+    # Writes fsync or take SQLite's write lock, so they run off the event loop.
+    if KEY_SECRET:
+        key, kid = generate_signed_key(expires_at)
+        await asyncio.to_thread(key_store.add, key, {
+            "expires": iso_utc(expires_at),
+            "expires_at": expires_at,
+            "kid": kid,
+            "active": True
+        })
+    else:
+        key = generate_key()
+        expires = (datetime.utcnow() + timedelta(days=days)).isoformat()
+        await asyncio.to_thread(key_store.add, key, {
+            "expires": expires,
+            "expires_at": expiry_epoch(expires),
+            "active": True
+        })
 
     await update.message.reply_text(
         f"✅ KEY GENERATED\n\n"
@@ -94,14 +593,20 @@ async def revoke(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     key = context.args[0]
-    data = load_keys()
-
-    if key not in data:
-        await update.message.reply_text("❌ Key not found")
-        return
-
-    data[key]["active"] = False
-    save_keys(data)
+    # Writes fsync or take SQLite's write lock, so they run off the event loop.
+    if not await asyncio.to_thread(key_store.revoke, key):
+        claims = verify_signed_key(key)
+        if claims is None:
+            await update.message.reply_text("❌ Key not found")
+            return
+        # A signed key this store never saw (e.g. issued before a reset).
+        kid, expires_at = claims
+        await asyncio.to_thread(key_store.add, key, {
+            "expires": iso_utc(expires_at),
+            "expires_at": expires_at,
+            "kid": kid,
+            "active": False
+        })
 
     await update.message.reply_text(f"🚫 Key revoked:\n{key}")
 
@@ -109,33 +614,152 @@ async def listkeys(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
         return
 
-    data = load_keys()
+    # A copy: the background reload may apply new rows while we iterate.
+    data = dict(key_store.all())
     if not data:
         await update.message.reply_text("No keys found.")
         return
 
-    msg = "🔑 ACTIVE KEYS:\n\n"
+    groups = {"active": [], "expired": [], "revoked": []}
     for k, v in data.items():
-        status = "✅" if v["active"] else "❌"
-        msg += f"{status} {k}\n⏰ {v['expires']}\n\n"
+        groups[key_store.state(k, v)].append((k, v))
+
+    stats = key_store.stats()
+    msg = (
+        f"📊 {stats['active']} active | {stats['expired']} expired | "
+        f"{stats['revoked']} revoked\n\n"
+    )
+    for state, icon, title in (
+        ("active", "✅", "ACTIVE KEYS"),
+        ("expired", "⌛", "EXPIRED KEYS"),
+        ("revoked", "❌", "REVOKED KEYS"),
+    ):
+        entries = groups[state]
+        if not entries:
+            continue
+        msg += f"🔑 {title}:\n\n"
+        shown = 0
+        for k, v in entries:
+            line = f"{icon} {k}\n⏰ {v['expires']}\n\n"
+            if len(msg) + len(line) > LIST_KEYS_MAX_CHARS - LIST_KEYS_RESERVE:
+                break
+            msg += line
+            shown += 1
+        if shown < len(entries):
+            msg += f"… and {len(entries) - shown} more\n\n"
 
     await update.message.reply_text(msg)
 
 # =========================
-# API ENDPOINT (FOR LGL)
+# RATE LIMIT
 # =========================
-@api.get("/check")
-def check_key(key: str):
-    data = load_keys()
+class ClientRateLimiter:
+    """Token bucket per client IP, refilled at ``rate`` tokens/s up to ``burst``.
+
+    Only the ``max_clients`` most recently seen clients are remembered.
+    """
+
+    def __init__(self, rate, burst, max_clients=CHECK_RATE_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # {ip: [tokens, last refill (monotonic)]}
+        self.limited = 0
+
+    def allow(self, client, cost=1):
+        """Returns 0 if allowed, otherwise seconds until ``cost`` tokens are available."""
+        if self.rate <= 0:
+            return 0
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = [self.burst, now]
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0
+        self.limited += 1
+        return (cost - bucket[0]) / self.rate
+
+check_limiter = ClientRateLimiter(CHECK_RATE_PER_SEC, CHECK_RATE_BURST)
+RATE_LIMITED_PATHS = {"/check", "/check/batch"}
+RATE_LIMITED_DETAIL = "Too many checks, slow down"
+
+def client_ip(scope):
+    # uvicorn's --proxy-headers has already replaced this with the forwarded
+    # address when the peer is a trusted proxy.
+    return scope["client"][0] if scope.get("client") else "unknown"
+
+def rate_limit(request: Request, cost=1):
+    wait = check_limiter.allow(client_ip(request.scope), cost)
+    if wait:
+        raise HTTPException(
+            status_code=429,
+            detail=RATE_LIMITED_DETAIL,
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+class CheckRateLimitMiddleware:
+    """Charges one token per /check request before FastAPI parses anything.
+
+    Rejecting a guess here costs about half as much as going through routing,
+    which keeps a flood from crowding out everyone else. /check/batch charges
+    for its remaining keys once the body is parsed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in RATE_LIMITED_PATHS:
+            wait = check_limiter.allow(client_ip(scope))
+            if wait:
+                body = json.dumps({"detail": RATE_LIMITED_DETAIL}).encode()
+                await send({
+                    "type": "http.response.start",
+                    "status": 429,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"retry-after", str(math.ceil(wait)).encode()),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
+
+api.add_middleware(CheckRateLimitMiddleware)
 
-    if key not in data:
+# =========================
+# API ENDPOINT (FOR LGL)
+# =========================
+def validate_key(key, now=None):
+    claims = verify_signed_key(key)
+    if claims is not None:
+        kid, expires_at = claims
+        if key_store.is_revoked_id(kid):
+            return {"status": "revoked"}
+        if (now or int(time.time())) >= expires_at:
+            return {"status": "expired"}
+        return {
+            "status": "valid",
+            "expires": iso_utc(expires_at)
+        }
+
+    info = key_store.get(key)
+    if info is None:
         return {"status": "invalid"}
 
-    info = data[key]
     if not info["active"]:
         return {"status": "revoked"}
 
-    if datetime.utcnow() > datetime.fromisoformat(info["expires"]):
+    if (now or int(time.time())) >= info["expires_at"]:
         return {"status": "expired"}
 
     return {
@@ -143,31 +767,190 @@ def check_key(key: str):
         "expires": info["expires"]
     }
 
+class BatchCheck(BaseModel):
+    keys: list[str]
+
+# Both endpoints only touch the in-memory store, so they run on the event loop
+# instead of FastAPI's threadpool.
+@api.get("/check")
+async def check_key(key: str):
+    return validate_key(key)
+
+@api.post("/check/batch")
+async def check_batch(body: BatchCheck, request: Request):
+    if len(body.keys) > CHECK_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {CHECK_BATCH_MAX} keys per request")
+    if len(body.keys) > 1:
+        rate_limit(request, len(body.keys) - 1)
+
+    now = int(time.time())
+    return {
+        "results": [{"key": key, **validate_key(key, now)} for key in body.keys]
+    }
+
+@api.get("/stats")
+async def key_stats(authorization: str = Header("")):
+    if not STATS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {STATS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return dict(
+        key_store.stats(),
+        rate_limited=check_limiter.limited,
+        webhook=update_queue.stats(),
+    )
+
 # =========================
 # TELEGRAM WEBHOOK
 # =========================
+class UpdateQueue:
+    """Bounded queue between the webhook endpoint and a pool of update workers.
+
+    The endpoint only checks the payload, enqueues it and answers, so a slow
+    handler never holds up the HTTP response and makes Telegram redeliver.
+    The last ``dedupe_size`` update_ids are remembered and redeliveries are
+    dropped. Workers process updates concurrently, so order is not kept.
+    """
+
+    def __init__(self, maxsize, workers, dedupe_size):
+        self.maxsize = maxsize
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize)
+        self._recent = deque(maxlen=dedupe_size)
+        self._recent_ids = set()
+        self._tasks = []
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def submit(self, update_id, payload):
+        """Returns False if the queue is full; the update_id is not remembered then."""
+        if update_id in self._recent_ids:
+            self.duplicates += 1
+            return True
+        try:
+            self._queue.put_nowait((time.monotonic(), payload))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        if len(self._recent) == self._recent.maxlen:
+            self._recent_ids.discard(self._recent[0])
+        self._recent.append(update_id)
+        self._recent_ids.add(update_id)
+        self.accepted += 1
+        return True
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10.0):
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print("webhook queue: dropped", self._queue.qsize(), "updates on shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self):
+        while True:
+            queued_at, payload = await self._queue.get()
+            lag = time.monotonic() - queued_at
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            try:
+                await application.process_update(Update.de_json(payload, application.bot))
+            except Exception as e:
+                self.failed += 1
+                print("update error:", e)
+            finally:
+                self.processed += 1
+                self._queue.task_done()
+
+    def stats(self):
+        return {
+            "depth": self._queue.qsize(),
+            "capacity": self.maxsize,
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "lag_avg_ms": round(self.lag_total / self.processed * 1000, 2) if self.processed else 0,
+            "lag_max_ms": round(self.lag_max * 1000, 2),
+        }
+
+update_queue = UpdateQueue(WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS, WEBHOOK_DEDUPE_SIZE)
+
 @api.post(WEBHOOK_PATH)
 async def telegram_webhook(request: Request):
-    update = Update.de_json(await request.json(), application.bot)
-    await application.process_update(update)
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    update_id = payload.get("update_id") if isinstance(payload, dict) else None
+    if not isinstance(update_id, int):
+        raise HTTPException(status_code=400, detail="Not a Telegram update")
+
+    # 503 makes Telegram retry later instead of us dropping the update.
+    if not update_queue.submit(update_id, payload):
+        raise HTTPException(status_code=503, detail="Update queue full")
     return {"ok": True}
 
 # =========================
 # STARTUP
 # =========================
+def build_application(builder=None):
+    app = (builder or ApplicationBuilder().token(BOT_TOKEN)).build()
+
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("genkey", genkey))
+    app.add_handler(CommandHandler("revoke", revoke))
+    app.add_handler(CommandHandler("listkeys", listkeys))
+    return app
+
 @api.on_event("startup")
 async def startup():
     global application
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    application = build_application()
 
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("genkey", genkey))
-    application.add_handler(CommandHandler("revoke", revoke))
-    application.add_handler(CommandHandler("listkeys", listkeys))
+    await start_key_store()
 
     await application.initialize()
+    update_queue.start()
     await application.bot.set_webhook(WEBHOOK_URL)
 
+async def start_key_store():
+    global sweeper
+    await asyncio.to_thread(key_store.refresh, True)
+    sweeper = asyncio.create_task(maintain_key_store())
+
+async def maintain_key_store():
+    # Reloads can re-parse KEY_DB or run SQL and sweeps take the store lock,
+    # so both run in a thread; requests only read the in-memory index.
+    swept = time.monotonic()
+    while True:
+        await asyncio.sleep(key_store.reload_interval)
+        try:
+            await asyncio.to_thread(key_store.refresh, True)
+            if time.monotonic() - swept >= KEY_SWEEP_INTERVAL:
+                swept = time.monotonic()
+                await asyncio.to_thread(key_store.sweep)
+        except Exception as e:
+            print("key store error:", e)
+
+@api.on_event("shutdown")
+async def shutdown():
+    if sweeper:
+        sweeper.cancel()
+    await update_queue.stop()
+    key_store.close()
+
 # =========================
 # HEALTH
 # =========================
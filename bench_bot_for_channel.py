@@ -0,0 +1,402 @@
+"""Micro-benchmarks for the Bot_for_channel hot paths.
+
+Run with:  python bench_bot_for_channel.py [section ...]
+
+The ``replay`` section drives synthetic updates through the real Application
+against an in-process fake Bot API. Set REPLAY_UPDATES to a JSONL file of
+recorded Update payloads to replay those instead; REPLAY_LATENCY sets the fake
+API latency in seconds.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+import Bot_for_channel as bot
+
+# ================= RESPONDERS =================
+RESPONDER_SAMPLES = [
+    "kazeee",
+    "hello everyone",
+    "salamat po sa game",
+    "good night guys",
+    "anong oras na ba",
+    "gg wp",
+    "palaro na ba?",
+    "who are you",
+    "lorem ipsum dolor sit amet, consectetur adipiscing elit " * 3,
+    "random chatter that matches nothing at all here",
+    "3",
+    "5",
+]
+
+def legacy_responder(text_lower):
+    # The if/re.search chain handle_text used before the compiled table.
+    if re.search(r"\bkaze+\b", text_lower):
+        return " Pogi si Kaze!"
+    if re.search(r"\bkuri\b", text_lower):
+        return " Pogi"
+    if re.search(r"\bphia\b", text_lower):
+        return "🥹 Phia maganda"
+    if re.search(r"\b(hi|hello|hey|yo|hoy)\b", text_lower):
+        return "👋 Hi! Kumusta ka?"
+    if re.search(r"\b(thanks|thank you|thx|salamat)\b", text_lower):
+        return "🙏 Walang anuman! 😊"
+    if re.search(r"\b(good night|gn|gabing gabi)\b", text_lower):
+        return "🌙 Good night too 😴"
+    if re.search(r"\b(good morning|gm|umaga na)\b", text_lower):
+        return "☀️ Good morning too! 😏"
+    if re.search(r"\b(anong oras na ba|what time is it|time)\b", text_lower):
+        return bot.time_check_reply
+    if re.search(r"\b(ano ang pangalan mo|who are you)\b", text_lower):
+        return "🤖 Ako si Kazebot!"
+    if re.search(r"\b(gg|good game)\b", text_lower):
+        return "🎮 GG! Nice play!"
+    if re.search(r"\bpalaro\b", text_lower):
+        return " Mga kupal"
+    if text_lower in ["1", "2", "3", "4", "5", "6"]:
+        return "pick"
+    return None
+
+def compiled_responder(text_lower):
+    if text_lower in bot.PICK_NUMBERS:
+        return "pick"
+    responder = bot.match_responder(text_lower)
+    return responder[2] if responder else None
+
+def bench_responders(number=20000):
+    for text in RESPONDER_SAMPLES:
+        assert legacy_responder(text) == compiled_responder(text), text
+
+    for name, fn in (("legacy chain", legacy_responder), ("compiled table", compiled_responder)):
+        elapsed = timeit.timeit(
+            lambda: [fn(t) for t in RESPONDER_SAMPLES], number=number
+        )
+        per_msg = elapsed / (number * len(RESPONDER_SAMPLES)) * 1e9
+        print(f"responders  {name:<16} {per_msg:8.0f} ns/msg")
+
+
+# ================= FLOOD CONTROL =================
+def run_flood(senders, users):
+    tracker = bot.FloodTracker(bot.FLOOD_MAX_MESSAGES, bot.FLOOD_WINDOW_SECONDS, users)
+    now = time.monotonic()
+    started = time.perf_counter()
+    for i, (chat_id, user_id) in enumerate(senders):
+        tracker.hit(chat_id, user_id, now + i * 1e-4)
+    return tracker, time.perf_counter() - started
+
+def bench_flood(users=100_000, messages=1_000_000):
+    rng = random.Random(1)
+    for label, population in (("fits", users), ("2x churn", users * 2)):
+        senders = [(-(u % 500) - 1, u) for u in (rng.randrange(population) for _ in range(messages))]
+        tracker, elapsed = run_flood(senders, users)
+        # Memory is measured on a separate pass; tracemalloc distorts timings.
+        tracemalloc.start()
+        run_flood(senders, users)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"flood       {label:<9} {elapsed / messages * 1e9:6.0f} ns/msg  "
+            f"tracked {len(tracker):,}  evicted {tracker.evicted:,}  peak {peak / 2**20:.1f} MiB"
+        )
+
+
+# ================= NEAR-DUPLICATE SPAM =================
+def spam_stream(messages, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocab = ["".join(rng.choices(letters, k=rng.randint(2, 9))) for _ in range(5000)]
+    templates = [" ".join(rng.choices(vocab, k=rng.randint(15, 40))) for _ in range(50)]
+    stream = []
+    for _ in range(messages):
+        if rng.random() < 0.3:
+            words = rng.choice(templates).split()
+            words[rng.randrange(len(words))] = rng.choice(vocab)  # small variation
+            stream.append((" ".join(words), rng.randrange(10**6)))
+        else:
+            stream.append((" ".join(rng.choices(vocab, k=rng.randint(3, 40))), rng.randrange(10**6)))
+    return stream
+
+def bench_spam(messages=100_000):
+    stream = spam_stream(messages, random.Random(2))
+    index = bot.SpamFingerprints(
+        bot.SPAM_DUP_THRESHOLD, bot.SPAM_DUP_WINDOW, bot.SPAM_DUP_SIMILARITY,
+        bot.SPAM_DUP_MIN_CHARS, bot.SPAM_DUP_MAX_CLUSTERS,
+    )
+    now = time.monotonic()
+    started = time.perf_counter()
+    for i, (text, user_id) in enumerate(stream):
+        index.check(text, user_id, now + i * 1e-3)
+    elapsed = time.perf_counter() - started
+    print(
+        f"spam        {messages / elapsed:12,.0f} msgs/s  {elapsed / messages * 1e6:6.1f} us/msg  "
+        f"clusters {len(index):,}  flagged {index.flagged:,}"
+    )
+
+
+# ================= GAME JOURNAL =================
+def bench_journal(events=100_000, chats=200):
+    directory = tempfile.mkdtemp(prefix="kazebot-journal-")
+    journal = bot.GameJournal(directory, bot.SNAPSHOT_EVERY)
+    journal.start()
+    picks = [
+        ("pick", -(i % chats) - 1, i % 6 + 1, 1000 + i, f'<a href="tg://user?id={1000 + i}">P</a>')
+        for i in range(events)
+    ]
+    for event in picks[:chats * 6]:
+        bot.apply_game_event(event)
+
+    started = time.perf_counter()
+    for event in picks:
+        journal.record(*event)
+    elapsed = time.perf_counter() - started
+    asyncio.run(journal.stop())
+    print(f"journal     record          {elapsed / events * 1e6:6.2f} us/event "
+          f"(snapshot every {bot.SNAPSHOT_EVERY}, {chats} live games)")
+
+    # Restore cost: snapshot plus a journal tail just short of the next snapshot
+    tail = bot.GameJournal(directory, events * 2)
+    tail.start()
+    for event in picks[:bot.SNAPSHOT_EVERY - 1]:
+        tail.record(*event)
+    tail._queue.put(tail._STOP)
+    tail._thread.join()
+    started = time.perf_counter()
+    replayed = bot.GameJournal(directory, bot.SNAPSHOT_EVERY).restore()
+    print(f"journal     restore         {(time.perf_counter() - started) * 1000:6.2f} ms "
+          f"(snapshot + {replayed} tail events)")
+
+
+# ================= COLD START =================
+COLD_START_PROBE = """
+import sys, time
+started = time.perf_counter()
+import Bot_for_channel as bot
+print((time.perf_counter() - started) * 1000, "flask" in sys.modules, bot.startup.phases["tables"])
+"""
+
+def bench_startup(runs=5):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", COLD_START_PROBE],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.split()
+        samples.append((float(out[0]), out[1] == "True", float(out[2])))
+    samples.sort()
+    import_ms, flask_loaded, tables_ms = samples[len(samples) // 2]
+    print(f"startup     import {import_ms:6.1f} ms median of {runs} fresh interpreters "
+          f"(tables {tables_ms:.1f} ms, flask loaded: {flask_loaded}, "
+          f"budget {bot.STARTUP_BUDGET_MS:.0f} ms to first update)")
+
+
+# ================= WELCOME BATCHING =================
+class FakeChat:
+    """Just enough of a Chat for WelcomeBatcher; counts the calls it makes."""
+
+    def __init__(self, chat_id: int, calls: dict):
+        self.id = chat_id
+        self.calls = calls
+        self._message_id = 0
+
+    async def send_message(self, text, **kwargs):
+        self.calls["sendMessage"] += 1
+        self._message_id += 1
+        return type("Sent", (), {"message_id": self._message_id})()
+
+    def get_bot(self):
+        return self
+
+    async def delete_message(self, chat_id, message_id):
+        self.calls["deleteMessage"] += 1
+        return True
+
+def bench_welcome(joins=3000, chats=5, seconds=3.0, debounce=0.5):
+    async def run():
+        bot.OUTBOX_GLOBAL_RATE = bot.OUTBOX_GROUP_PER_MINUTE = bot.OUTBOX_PRIVATE_RATE = 1e9
+        bot.outbox = bot.Outbox()
+        bot.outbox.start()
+        calls = {"sendMessage": 0, "deleteMessage": 0}
+        fake_chats = [FakeChat(-1000 - i, calls) for i in range(chats)]
+        batcher = bot.WelcomeBatcher(debounce, delete_previous=True)
+        for i in range(joins):
+            batcher.add(fake_chats[i % chats], [(10 + i, "Player")])
+            if i % 100 == 99:
+                await asyncio.sleep(seconds * 100 / joins)
+        await batcher.stop()
+        await bot.outbox.stop()
+        return calls
+
+    calls = asyncio.run(run())
+    total = sum(calls.values())
+    print(f"welcome     {joins:,} joins in {chats} chats over {seconds:.0f}s, {debounce}s window: "
+          f"{total} API calls ({calls['sendMessage']} welcomes, {calls['deleteMessage']} deletes) "
+          f"vs {joins:,} unbatched, {joins / total:.0f}x fewer")
+
+
+# ================= OFFLINE REPLAY =================
+class FakeBotAPI(BaseRequest):
+    """In-process Bot API: records every call and answers after ``latency`` seconds."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = {}
+        self._message_id = 10**6
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+    def _result(self, endpoint, params):
+        if endpoint == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Kazebot", "username": "kazebot"}
+        if endpoint in ("sendMessage",):
+            self._message_id += 1
+            chat_id = int(params["chat_id"])
+            return {
+                "message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Kazebot"},
+                "text": params.get("text", ""),
+            }
+        if endpoint == "getChatMember":
+            return {"status": "member", "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "U"}}
+        if endpoint == "getChatAdministrators":
+            return [{"status": "creator", "is_anonymous": False,
+                     "user": {"id": 2, "is_bot": False, "first_name": "Admin"}}]
+        return True
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+
+def synthetic_update(update_id: int, rng: random.Random, chats: int, users_per_chat: int = 300) -> dict:
+    chat_index = rng.randrange(chats)
+    chat_id = -1000 - chat_index
+    user_id = 10 + chat_index * users_per_chat + rng.randrange(users_per_chat)
+    user = {"id": user_id, "is_bot": False, "first_name": "Player"}
+    message = {
+        "message_id": update_id, "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "supergroup", "title": "Palaro"}, "from": user,
+    }
+    roll = rng.random()
+    if roll < 0.30:
+        message["text"] = rng.choice("123456")
+    elif roll < 0.75:
+        message["text"] = rng.choice(RESPONDER_SAMPLES)
+    elif roll < 0.80:
+        message["caption"] = "promo at example.xyz"
+        message["photo"] = [{"file_id": "p", "file_unique_id": "p", "width": 1, "height": 1}]
+    elif roll < 0.85:
+        message["text"] = "look at this"
+        message["forward_origin"] = {"type": "hidden_user", "date": int(time.time()), "sender_user_name": "x"}
+    elif roll < 0.90:
+        message["new_chat_members"] = [user]
+    else:
+        message["text"] = "/roll"
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": 5}]
+    return {"update_id": update_id, "message": message}
+
+def percentile(sorted_values, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+async def replay(payloads, latency: float):
+    # Telegram's send limits are what the outbox enforces in production; lift them
+    # here so the numbers reflect the bot's own cost.
+    bot.OUTBOX_GLOBAL_RATE = bot.OUTBOX_GROUP_PER_MINUTE = bot.OUTBOX_PRIVATE_RATE = 1e9
+    bot.outbox = bot.Outbox()
+    bot.game_journal = bot.GameJournal(tempfile.mkdtemp(prefix="kazebot-replay-"), bot.SNAPSHOT_EVERY)
+    api = FakeBotAPI(latency)
+    app = bot.build_application("123:REPLAY", request=api)
+    await app.initialize()
+    await app.post_init(app)
+    calls_before = api.total
+
+    updates = [Update.de_json(p, app.bot) for p in payloads]
+    latencies = []   # handlers only
+    end_to_end = []  # including the wait for a per-chat turn and a concurrency slot
+
+    async def handle(update):
+        started = time.perf_counter()
+        await app.process_update(update)
+        latencies.append(time.perf_counter() - started)
+
+    async def run(update):
+        started = time.perf_counter()
+        await app.update_processor.process_update(update, handle(update))
+        end_to_end.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(u) for u in updates))
+    handled = time.perf_counter() - started
+    deadline = time.monotonic() + 30
+    while bot.outbox.stats()["pending"] and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+    await app.post_stop(app)
+    await app.shutdown()
+    latencies.sort()
+    end_to_end.sort()
+    return {
+        "updates": len(updates),
+        "updates_per_s": len(updates) / handled,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "e2e_p99_ms": percentile(end_to_end, 0.99) * 1000,
+        "api_calls_per_update": (api.total - calls_before) / len(updates),
+        "calls": api.calls,
+    }
+
+def bench_replay(updates=20_000, chats=50):
+    latency = float(os.getenv("REPLAY_LATENCY", "0.02"))
+    recorded = os.getenv("REPLAY_UPDATES")
+    if recorded:
+        with open(recorded, encoding="utf-8") as f:
+            payloads = [json.loads(line) for line in f if line.strip()]
+    else:
+        rng = random.Random(3)
+        payloads = [synthetic_update(i + 1, rng, chats) for i in range(updates)]
+    result = asyncio.run(replay(payloads, latency))
+    print(
+        f"replay      {result['updates']:,} updates  {result['updates_per_s']:10,.0f} updates/s  "
+        f"handler p50 {result['p50_ms']:.2f} ms  p99 {result['p99_ms']:.2f} ms  "
+        f"{result['api_calls_per_update']:.2f} API calls/update (latency {latency * 1000:.0f} ms)"
+    )
+    print(f"            all updates submitted at once; end-to-end p99 {result['e2e_p99_ms']:.0f} ms")
+    print("            calls:", dict(sorted(result["calls"].items())))
+
+
+SECTIONS = {
+    "responders": bench_responders,
+    "flood": bench_flood,
+    "spam": bench_spam,
+    "journal": bench_journal,
+    "welcome": bench_welcome,
+    "startup": bench_startup,
+    "replay": bench_replay,
+}
+
+if __name__ == "__main__":
+    for section in sys.argv[1:] or SECTIONS:
+        SECTIONS[section]()